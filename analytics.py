@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Per-pair hourly aggregates (pair_hourly_stats) and the derived analytics
+served by /pair/{pair_launcher_id}/analytics and, for liquidity providers,
+/pair/{pair_launcher_id}/liquidity.
+
+The syncer updates the aggregates together with each committed chunk of
+transactions, and reorg rollbacks rebuild the affected hours. To fill them
+for an existing database (e.g. after upgrading), run:
+```
+python analytics.py rebuild [pair_launcher_id]
+```
+"""
+
+from sqlalchemy.orm import Session
+from typing import Iterator, List, Optional
+from dotenv import load_dotenv
+import sys
+
+import models
+
+HOUR = 3600
+YEAR_HOURS = 365 * 24
+
+# windows reported by get_pair_analytics, in hours
+ANALYTICS_WINDOWS = {"24h": 24, "7d": 7 * 24, "30d": 30 * 24}
+
+# XCH amounts (in XCH) for which the price impact of a buy is reported
+PRICE_IMPACT_AMOUNTS = [1, 10, 100]
+
+
+def hour_of(timestamp: int) -> int:
+    return timestamp // HOUR * HOUR
+
+
+def spot_price(xch_reserve: int, token_reserve: int):
+    # XCH (1e12 mojos) per token (1e3 mojos)
+    return xch_reserve / 10 ** 12 / (token_reserve / 1000) if token_reserve > 0 else None
+
+
+def swap_fee(state_change: dict, inverse_fee: int) -> int:
+    # Fee (in mojos) paid by a swap. XCH in: the fee is taken from the input.
+    # Token in: the XCH output was computed from the fee-reduced input, so the
+    # fee's XCH value is output * fee / inverse_fee.
+    xch_change = state_change["xch"]
+    if xch_change > 0:
+        return xch_change * (1000 - inverse_fee) // 1000
+    return -xch_change * (1000 - inverse_fee) // inverse_fee
+
+
+def update_hourly_stats(db: Session, pair: models.Pair, transactions: List[models.Transaction], load_existing: bool = True):
+    # transactions must be in pair_tx_index order; load_existing=False if none
+    # of their hours has a row yet (saves a lookup per hour)
+    stats_by_hour = {}
+    for tx in transactions:
+        hour = hour_of(tx.timestamp)
+        stats = stats_by_hour.get(hour)
+        if stats is None:
+            stats = db.get(models.PairHourlyStats, (pair.launcher_id, hour)) if load_existing else None
+            if stats is None:
+                stats = models.PairHourlyStats(
+                    pair_launcher_id=pair.launcher_id,
+                    hour=hour,
+                    transaction_count=0,
+                    swap_count=0,
+                    trade_volume=0,
+                    fee_revenue=0,
+                    liquidity_added=0,
+                    liquidity_removed=0,
+                    liquidity_xch_flow=0,
+                    liquidity_token_flow=0,
+                )
+                db.add(stats)
+            stats_by_hour[hour] = stats
+
+        stats.transaction_count += 1
+        if tx.operation == "SWAP":
+            stats.swap_count += 1
+            stats.trade_volume += abs(tx.state_change["xch"])
+            stats.fee_revenue += swap_fee(tx.state_change, int(pair.inverse_fee))
+        else:
+            # liquidity tokens minted / burned; reserves deposited (positive)
+            # or withdrawn (negative) by liquidity providers
+            if tx.state_change["liquidity"] > 0:
+                stats.liquidity_added += tx.state_change["liquidity"]
+            else:
+                stats.liquidity_removed -= tx.state_change["liquidity"]
+            stats.liquidity_xch_flow += tx.state_change["xch"]
+            stats.liquidity_token_flow += tx.state_change["token"]
+
+        stats.xch_reserve = tx.new_state["xch"]
+        stats.token_reserve = tx.new_state["token"]
+        stats.liquidity = tx.new_state["liquidity"]
+
+
+def rebuild_hourly_stats(db: Session, pair: models.Pair, from_timestamp: int = 0):
+    # recomputes all hours from hour_of(from_timestamp) on from the transactions
+    from_hour = hour_of(from_timestamp)
+    (
+        db.query(models.PairHourlyStats)
+        .filter(models.PairHourlyStats.pair_launcher_id == pair.launcher_id)
+        .filter(models.PairHourlyStats.hour >= from_hour)
+        .delete()
+    )
+
+    transactions = (
+        db.query(models.Transaction)
+        .filter(models.Transaction.pair_launcher_id == pair.launcher_id)
+        .filter(models.Transaction.timestamp >= from_hour)
+        .order_by(models.Transaction.pair_tx_index)
+        .all()
+    )
+    # their hours were all deleted above
+    update_hourly_stats(db, pair, transactions, load_existing=False)
+
+
+def hourly_closes(hourly_stats: list, previous_stats, first_hour: int, last_hour: int) -> Iterator:
+    # for every hour from first_hour to last_hour: the stats row in effect at
+    # its end (the latest one at or before it; previous_stats before any of
+    # hourly_stats, which must be ordered by hour)
+    close = previous_stats
+    stats_index = 0
+    for hour in range(first_hour, last_hour + HOUR, HOUR):
+        while stats_index < len(hourly_stats) and hourly_stats[stats_index].hour <= hour:
+            close = hourly_stats[stats_index]
+            stats_index += 1
+        yield close
+
+
+def load_hourly_stats(db: Session, pair_launcher_id: str, first_hour: int):
+    # (rows after first_hour by hour, the last row at or before it); the
+    # latter holds the reserves going into the period, for time-weighted averages
+    hourly_stats = (
+        db.query(models.PairHourlyStats)
+        .filter(models.PairHourlyStats.pair_launcher_id == pair_launcher_id)
+        .filter(models.PairHourlyStats.hour > first_hour)
+        .order_by(models.PairHourlyStats.hour)
+        .all()
+    )
+    previous_stats = (
+        db.query(models.PairHourlyStats)
+        .filter(models.PairHourlyStats.pair_launcher_id == pair_launcher_id)
+        .filter(models.PairHourlyStats.hour <= first_hour)
+        .order_by(models.PairHourlyStats.hour.desc())
+        .first()
+    )
+    return hourly_stats, previous_stats
+
+
+def get_pair_analytics(db: Session, pair: models.Pair, now: int, history_hours: int) -> dict:
+    longest_window = max(ANALYTICS_WINDOWS.values())
+    first_hour = hour_of(now) - max(longest_window, history_hours) * HOUR
+
+    hourly_stats, previous_stats = load_hourly_stats(db, pair.launcher_id, first_hour)
+    prices = dict(
+        db.query(models.AverageUsdPrice.from_timestamp, models.AverageUsdPrice.price_cents)
+        .filter(models.AverageUsdPrice.from_timestamp > first_hour)
+        .all()
+    )
+    latest_price = db.query(models.AverageUsdPrice).order_by(models.AverageUsdPrice.from_timestamp.desc()).first()
+
+    xch_reserve = int(pair.xch_reserve)
+    token_reserve = int(pair.token_reserve)
+    inverse_fee = int(pair.inverse_fee)
+
+    windows = {}
+    for name, hours in ANALYTICS_WINDOWS.items():
+        window_start = hour_of(now) - hours * HOUR
+        in_window = [stats for stats in hourly_stats if stats.hour > window_start]
+
+        trade_volume = sum(stats.trade_volume for stats in in_window)
+        fee_revenue = sum(stats.fee_revenue for stats in in_window)
+        trade_volume_usd = sum(stats.trade_volume * prices.get(stats.hour, 0) // 10 ** 12 for stats in in_window)
+        fee_revenue_usd = sum(stats.fee_revenue * prices.get(stats.hour, 0) // 10 ** 12 for stats in in_window)
+
+        # time-weighted average XCH reserve over the window (hourly closes)
+        reserve_sum = sum(
+            close.xch_reserve if close is not None else 0
+            for close in hourly_closes(hourly_stats, previous_stats, window_start + HOUR, hour_of(now))
+        )
+        average_tvl = 2 * reserve_sum / hours
+
+        windows[name] = {
+            "transaction_count": sum(stats.transaction_count for stats in in_window),
+            "swap_count": sum(stats.swap_count for stats in in_window),
+            "trade_volume": trade_volume,
+            "trade_volume_usd": trade_volume_usd,
+            "fee_revenue": fee_revenue,
+            "fee_revenue_usd": fee_revenue_usd,
+            # fees earned by LPs relative to the average TVL, annualized
+            "apr": fee_revenue / average_tvl * YEAR_HOURS / hours if average_tvl > 0 else 0,
+        }
+
+    current_price = spot_price(xch_reserve, token_reserve)
+
+    price_impact = []
+    for xch_amount in PRICE_IMPACT_AMOUNTS:
+        xch_in = xch_amount * 10 ** 12
+        if xch_reserve == 0 or token_reserve == 0:
+            break
+        # same formula as the pair puzzle (constant product, fee on the input)
+        tokens_out = token_reserve * xch_in * inverse_fee // (xch_reserve * 1000 + xch_in * inverse_fee)
+        if tokens_out == 0:
+            continue
+        execution_price = xch_in / 10 ** 12 / (tokens_out / 1000)
+        price_impact.append({
+            "xch_in": xch_in,
+            "tokens_out": tokens_out,
+            "price_impact": execution_price / current_price - 1,
+        })
+
+    history_start = hour_of(now) - history_hours * HOUR
+    liquidity_history = [
+        {
+            "hour": stats.hour,
+            "xch_reserve": stats.xch_reserve,
+            "token_reserve": stats.token_reserve,
+            "liquidity": stats.liquidity,
+        }
+        for stats in hourly_stats if stats.hour > history_start
+    ]
+
+    return {
+        "launcher_id": pair.launcher_id,
+        "inverse_fee": inverse_fee,
+        "xch_reserve": xch_reserve,
+        "token_reserve": token_reserve,
+        "liquidity": int(pair.liquidity),
+        "spot_price": current_price,
+        "tvl": 2 * xch_reserve,
+        "tvl_usd": 2 * xch_reserve * latest_price.price_cents // 10 ** 12 if latest_price is not None else None,
+        "windows": windows,
+        "price_impact": price_impact,
+        "liquidity_history": liquidity_history,
+    }
+
+
+def per_liquidity(amount: int, liquidity: int) -> Optional[float]:
+    # reserve amount (mojos) backing one liquidity token mojo
+    return amount / liquidity if liquidity > 0 else None
+
+
+def get_pair_liquidity_analytics(db: Session, pair: models.Pair, now: int, history_hours: int) -> dict:
+    longest_window = max(ANALYTICS_WINDOWS.values())
+    first_hour = hour_of(now) - max(longest_window, history_hours) * HOUR
+
+    hourly_stats, previous_stats = load_hourly_stats(db, pair.launcher_id, first_hour)
+
+    windows = {}
+    for name, hours in ANALYTICS_WINDOWS.items():
+        window_start = hour_of(now) - hours * HOUR
+        in_window = [stats for stats in hourly_stats if stats.hour > window_start]
+
+        liquidity_added = sum(stats.liquidity_added for stats in in_window)
+        liquidity_removed = sum(stats.liquidity_removed for stats in in_window)
+
+        # time-weighted averages over the window's hourly closes (hours before
+        # the pair had liquidity are skipped)
+        closes = [
+            close for close in hourly_closes(hourly_stats, previous_stats, window_start + HOUR, hour_of(now))
+            if close is not None and close.liquidity > 0
+        ]
+
+        windows[name] = {
+            "liquidity_events": sum(stats.transaction_count - stats.swap_count for stats in in_window),
+            "liquidity_added": liquidity_added,
+            "liquidity_removed": liquidity_removed,
+            "net_liquidity": liquidity_added - liquidity_removed,
+            "xch_flow": sum(stats.liquidity_xch_flow for stats in in_window),
+            "token_flow": sum(stats.liquidity_token_flow for stats in in_window),
+            "average_xch_per_liquidity": sum(close.xch_reserve / close.liquidity for close in closes) / len(closes) if len(closes) > 0 else None,
+            "average_token_per_liquidity": sum(close.token_reserve / close.liquidity for close in closes) / len(closes) if len(closes) > 0 else None,
+        }
+
+    history_start = hour_of(now) - history_hours * HOUR
+    history = [
+        {
+            "hour": stats.hour,
+            "liquidity": stats.liquidity,
+            "xch_per_liquidity": per_liquidity(stats.xch_reserve, stats.liquidity),
+            "token_per_liquidity": per_liquidity(stats.token_reserve, stats.liquidity),
+            "liquidity_added": stats.liquidity_added,
+            "liquidity_removed": stats.liquidity_removed,
+            "xch_flow": stats.liquidity_xch_flow,
+            "token_flow": stats.liquidity_token_flow,
+        }
+        for stats in hourly_stats if stats.hour > history_start
+    ]
+
+    liquidity = int(pair.liquidity)
+    return {
+        "launcher_id": pair.launcher_id,
+        "liquidity": liquidity,
+        "xch_reserve": int(pair.xch_reserve),
+        "token_reserve": int(pair.token_reserve),
+        "xch_per_liquidity": per_liquidity(int(pair.xch_reserve), liquidity),
+        "token_per_liquidity": per_liquidity(int(pair.token_reserve), liquidity),
+        "windows": windows,
+        "history": history,
+    }
+
+
+def get_state_at(db: Session, pair_launcher_id: str, height: Optional[int] = None, timestamp: Optional[int] = None):
+    # the pair's last transaction at or below a height (or block timestamp),
+    # None before its first one; both lookups are single index seeks
+    if timestamp is not None:
+        # heights are only recorded for blocks with pair spends, and block
+        # timestamps grow with height, so the last recorded height at or
+        # before the timestamp covers exactly the transactions up to it
+        last_height = (
+            db.query(models.HeightToTimestamp.height)
+            .filter(models.HeightToTimestamp.timestamp <= timestamp)
+            .order_by(models.HeightToTimestamp.timestamp.desc(), models.HeightToTimestamp.height.desc())
+            .first()
+        )
+        height = last_height.height if last_height is not None else -1
+
+    query = db.query(
+        models.Transaction.height,
+        models.Transaction.timestamp,
+        models.Transaction.pair_tx_index,
+        models.Transaction.new_state
+    ).filter(models.Transaction.pair_launcher_id == pair_launcher_id)
+    if height is not None:
+        query = query.filter(models.Transaction.height <= height)
+    # served by idx_transactions_pair_height
+    return query.order_by(models.Transaction.height.desc(), models.Transaction.pair_tx_index.desc()).first()
+
+
+def get_liquidity_position(db: Session, pair: models.Pair, liquidity: int, since: int) -> Optional[dict]:
+    # what `liquidity` liquidity token mojos held since the `since` timestamp
+    # were worth then and now; None if the pair had no liquidity then.
+    # Swap fees stay in the reserves, so they are part of the current value.
+    opening = get_state_at(db, pair.launcher_id, timestamp=since)
+    if opening is None or opening.new_state["liquidity"] <= 0:
+        return None
+
+    deposited_xch = liquidity * opening.new_state["xch"] // opening.new_state["liquidity"]
+    deposited_token = liquidity * opening.new_state["token"] // opening.new_state["liquidity"]
+
+    xch_reserve = int(pair.xch_reserve)
+    token_reserve = int(pair.token_reserve)
+    pair_liquidity = int(pair.liquidity)
+    current_xch = liquidity * xch_reserve // pair_liquidity if pair_liquidity > 0 else 0
+    current_token = liquidity * token_reserve // pair_liquidity if pair_liquidity > 0 else 0
+
+    # in XCH mojos, at the current spot price
+    def xch_value(xch: int, token: int) -> int:
+        return xch + (token * xch_reserve // token_reserve if token_reserve > 0 else 0)
+
+    value = xch_value(current_xch, current_token)
+    hodl_value = xch_value(deposited_xch, deposited_token)
+    return {
+        "liquidity": liquidity,
+        "since": since,
+        "opening_height": opening.height,
+        "deposited": {"xch": deposited_xch, "token": deposited_token},
+        "current": {"xch": current_xch, "token": current_token},
+        "value": value,
+        # the deposited amounts, held instead of providing liquidity
+        "hodl_value": hodl_value,
+        "value_vs_hodl": value / hodl_value - 1 if hodl_value > 0 else None,
+    }
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ["rebuild"]:
+        print(__doc__)
+        sys.exit(1)
+
+    load_dotenv()
+    import database
+    database.init_db()
+    db = database.SessionLocal()
+
+    pairs = db.query(models.Pair)
+    if len(sys.argv) > 2:
+        pairs = pairs.filter(models.Pair.launcher_id == sys.argv[2])
+
+    for pair in pairs.all():
+        rebuild_hourly_stats(db, pair)
+        db.commit()
+        print(f"Rebuilt hourly stats of pair {pair.launcher_id}")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
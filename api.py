@@ -1,9 +1,13 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy import desc, func, BigInteger
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, desc, func, or_, type_coerce, BigInteger, String
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, timedelta
-import models, database, puzzle_hashes, time, usd_price_sync
+from encoding import FastJSONResponse, dumps
+import models, database, analytics, export, leaderboard, metrics, stream, time
+import base64
+import json
 import os
 
 app = APIRouter()
@@ -22,7 +26,47 @@ async def get_router(rcat: bool = False, db: Session = Depends(get_db)):
     return router
 
 
+# Read-only endpoints select only these columns: rows come back as plain
+# tuples (no ORM instances to build, track and expire) and are encoded
+# straight into a FastJSONResponse.
+PAIR_COLUMNS = (
+    models.Pair.launcher_id,
+    models.Pair.name,
+    models.Pair.short_name,
+    models.Pair.image_url,
+    models.Pair.asset_id,
+    models.Pair.hidden_puzzle_hash,
+    models.Pair.inverse_fee,
+    models.Pair.current_coin_id,
+    models.Pair.xch_reserve,
+    models.Pair.token_reserve,
+    models.Pair.liquidity,
+    models.Pair.trade_volume,
+    models.Pair.trade_volume_usd,
+)
+
+TRANSACTION_COLUMNS = (
+    models.Transaction.coin_id,
+    models.Transaction.pair_launcher_id,
+    models.Transaction.operation,
+    models.Transaction.state_change,
+    models.Transaction.new_state,
+    models.Transaction.height,
+    models.Transaction.pair_tx_index,
+    models.Transaction.timestamp,
+)
+
+
+# Same, but with the JSON columns as the stored text: /transactions splices
+# them into the response as-is instead of decoding and re-encoding them.
+TRANSACTION_RAW_COLUMNS = tuple(
+    type_coerce(column, String).label(column.key) if column.key in ["state_change", "new_state"] else column
+    for column in TRANSACTION_COLUMNS
+)
+
+
 def pair_to_json(pair: models.Pair):
+    # works for both Pair instances and PAIR_COLUMNS rows
     return {
         "launcher_id": pair.launcher_id,
         "name": pair.name,
@@ -40,21 +84,191 @@ def pair_to_json(pair: models.Pair):
     }
 
 
+PAIR_FIELDS = [column.key for column in PAIR_COLUMNS]
+
+# conversions applied to projected /pairs fields (others are returned as-is)
+PAIR_FIELD_CONVERTERS = {
+    "inverse_fee": int,
+    "xch_reserve": int,
+    "token_reserve": int,
+    "liquidity": int,
+    "trade_volume": int,
+    "trade_volume_usd": lambda value: int(value or 0),
+}
+
+# /pairs sort options; volumes are stored as strings and sorted numerically
+PAIR_SORT_KEYS = {
+    "xch_reserve": models.Pair.xch_reserve,
+    "token_reserve": models.Pair.token_reserve,
+    "liquidity": models.Pair.liquidity,
+    "trade_volume": func.cast(func.coalesce(models.Pair.trade_volume, "0"), BigInteger),
+    "trade_volume_usd": func.cast(func.coalesce(models.Pair.trade_volume_usd, "0"), BigInteger),
+    "name": models.Pair.name,
+    "launcher_id": models.Pair.launcher_id,
+}
+
+MAX_PAIRS_LIMIT = 1000
+MAX_PAIR_IDS = 500
+
+
+def split_list_param(values: Optional[List[str]]) -> List[str]:
+    # accepts both ?ids=a&ids=b and ?ids=a,b
+    if values is None:
+        return []
+    return [item.strip() for value in values for item in value.split(",") if item.strip() != ""]
+
+
+def encode_pairs_cursor(sort_value, launcher_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort_value, launcher_id]).encode()).decode()
+
+
+def decode_pairs_cursor(cursor: str):
+    try:
+        sort_value, launcher_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, launcher_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def transaction_to_json(transaction: models.Transaction):
+    # works for both Transaction instances and TRANSACTION_COLUMNS rows
+    return {
+        "coin_id": transaction.coin_id,
+        "pair_launcher_id": transaction.pair_launcher_id,
+        "operation": transaction.operation,
+        "state_change": transaction.state_change,
+        "new_state": transaction.new_state,
+        "height": transaction.height,
+        "pair_tx_index": transaction.pair_tx_index,
+        "timestamp": transaction.timestamp or 0
+    }
+
+
+def transactions_to_json_bytes(transactions) -> bytes:
+    # TRANSACTION_RAW_COLUMNS rows -> the JSON transaction_to_json would give
+    items = []
+    for transaction in transactions:
+        head = dumps({
+            "coin_id": transaction.coin_id,
+            "pair_launcher_id": transaction.pair_launcher_id,
+            "operation": transaction.operation,
+        })
+        tail = dumps({
+            "height": transaction.height,
+            "pair_tx_index": transaction.pair_tx_index,
+            "timestamp": transaction.timestamp or 0,
+        })
+        items.append(b"".join([
+            head[:-1],
+            b',"state_change":', (transaction.state_change or "null").encode(),
+            b',"new_state":', (transaction.new_state or "null").encode(),
+            b",", tail[1:],
+        ]))
+    return b"[" + b",".join(items) + b"]"
+
+
 @app.get("/pairs")
-async def get_pairs(db: Session = Depends(get_db)):
-    return await _get_pairs(db)
+async def get_pairs(
+    launcher_ids: Optional[List[str]] = Query(None),
+    asset_ids: Optional[List[str]] = Query(None),
+    fields: Optional[str] = None,
+    sort: str = "xch_reserve",
+    order: str = "desc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    # Without parameters, this returns all pairs (all fields) by XCH reserve.
+    # When a page is full, the X-Next-Cursor header holds the cursor for the
+    # next one (keyset pagination on the sort key + launcher_id).
+    launcher_ids = split_list_param(launcher_ids)
+    asset_ids = split_list_param(asset_ids)
+    if len(launcher_ids) + len(asset_ids) > MAX_PAIR_IDS:
+        raise HTTPException(status_code=400, detail=f"Cannot look up more than {MAX_PAIR_IDS} pairs at once")
+
+    if limit is not None and (limit < 1 or limit > MAX_PAIRS_LIMIT):
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_PAIRS_LIMIT}")
+
+    field_names = PAIR_FIELDS
+    if fields is not None:
+        field_names = split_list_param([fields])
+        unknown_fields = [field for field in field_names if field not in PAIR_FIELDS]
+        if len(unknown_fields) > 0:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown_fields)}")
+
+    sort_key = PAIR_SORT_KEYS.get(sort)
+    if sort_key is None:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(PAIR_SORT_KEYS)}")
+    if order not in ["asc", "desc"]:
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+
+    query = db.query(
+        *[getattr(models.Pair, field) for field in field_names],
+        sort_key.label("sort_value"),
+        models.Pair.launcher_id.label("cursor_launcher_id")
+    )
+
+    if len(launcher_ids) > 0 and len(asset_ids) > 0:
+        query = query.filter(or_(models.Pair.launcher_id.in_(launcher_ids), models.Pair.asset_id.in_(asset_ids)))
+    elif len(launcher_ids) > 0:
+        query = query.filter(models.Pair.launcher_id.in_(launcher_ids))
+    elif len(asset_ids) > 0:
+        query = query.filter(models.Pair.asset_id.in_(asset_ids))
+
+    if cursor is not None:
+        sort_value, launcher_id = decode_pairs_cursor(cursor)
+        if order == "desc":
+            query = query.filter(or_(sort_key < sort_value, and_(sort_key == sort_value, models.Pair.launcher_id < launcher_id)))
+        else:
+            query = query.filter(or_(sort_key > sort_value, and_(sort_key == sort_value, models.Pair.launcher_id > launcher_id)))
+
+    if order == "desc":
+        query = query.order_by(sort_key.desc(), models.Pair.launcher_id.desc())
+    else:
+        query = query.order_by(sort_key.asc(), models.Pair.launcher_id.asc())
+
+    if limit is not None:
+        # one extra row tells whether there is a next page
+        query = query.limit(limit + 1)
+    pairs = query.all()
+
+    headers = {}
+    if limit is not None and len(pairs) > limit:
+        pairs = pairs[:limit]
+        headers["X-Next-Cursor"] = encode_pairs_cursor(pairs[-1].sort_value, pairs[-1].cursor_launcher_id)
+
+    if fields is None:
+        return FastJSONResponse([pair_to_json(pair) for pair in pairs], headers=headers)
+
+    converters = [(field, PAIR_FIELD_CONVERTERS.get(field, lambda value: value)) for field in field_names]
+    return FastJSONResponse(
+        [{field: convert(getattr(pair, field)) for field, convert in converters} for pair in pairs],
+        headers=headers
+    )
 
 async def _get_pairs(db: Session, wrap=True):
-    pairs = (
+    # wrap=False returns tracked Pair instances, for the sync task to update;
+    # read paths query just the columns they need instead
+    if wrap:
+        pairs = db.query(*PAIR_COLUMNS).order_by(models.Pair.xch_reserve.desc()).all()
+        return [pair_to_json(pair) for pair in pairs]
+
+    return (
         db.query(models.Pair)
         .order_by(models.Pair.xch_reserve.desc())
         .all()
     )
-    return [pair_to_json(pair) for pair in pairs] if wrap else pairs
 
 @app.get("/pair-puzzle-hashes")
 async def get_pair_puzzle_hashes(db: Session = Depends(get_db)):
-    pairs = await _get_pairs(db, wrap=False)
+    # loads the chia wallet modules and parses the pair puzzles on first use
+    import puzzle_hashes
+
+    pairs = (
+        db.query(models.Pair.launcher_id, models.Pair.asset_id, models.Pair.hidden_puzzle_hash)
+        .order_by(models.Pair.xch_reserve.desc())
+        .all()
+    )
     response = {
         "warning": "Do *NOT* send any assets to these addresses - they will be lost forever",
         "info": []
@@ -68,10 +282,93 @@ async def get_pair_puzzle_hashes(db: Session = Depends(get_db)):
 
 @app.get("/pair/{pair_launcher_id}")
 async def get_pair(pair_launcher_id: str, db: Session = Depends(get_db)):
-    pair = db.query(models.Pair).filter(models.Pair.launcher_id == pair_launcher_id).first()
+    pair = db.query(*PAIR_COLUMNS).filter(models.Pair.launcher_id == pair_launcher_id).first()
+    if pair is None:
+        raise HTTPException(status_code=404, detail="Pair not found")
+    return FastJSONResponse(pair_to_json(pair))
+
+
+@app.get("/pair/{pair_launcher_id}/analytics")
+async def get_pair_analytics(pair_launcher_id: str, history_hours: int = 7 * 24, db: Session = Depends(get_db)):
+    # fee revenue, volume and LP APR per window, spot price, price impact and
+    # hourly liquidity history, all from the pair_hourly_stats aggregates
+    if history_hours < 0 or history_hours > 90 * 24:
+        raise HTTPException(status_code=400, detail="history_hours must be between 0 and 2160")
+
+    pair = db.query(*PAIR_COLUMNS).filter(models.Pair.launcher_id == pair_launcher_id).first()
     if pair is None:
         raise HTTPException(status_code=404, detail="Pair not found")
-    return pair_to_json(pair)
+
+    return FastJSONResponse(analytics.get_pair_analytics(db, pair, int(time.time()), history_hours))
+
+
+@app.get("/pair/{pair_launcher_id}/liquidity")
+async def get_pair_liquidity(
+    pair_launcher_id: str,
+    history_hours: int = 7 * 24,
+    position_liquidity: Optional[int] = None,
+    position_since: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    # liquidity provider view: liquidity added / removed and net reserve
+    # flows per window, reserves per liquidity token (current, window
+    # averages, hourly history), all from the pair_hourly_stats aggregates.
+    # With position_liquidity and position_since (timestamp), also the value
+    # of that many liquidity token mojos held since then.
+    if history_hours < 0 or history_hours > 90 * 24:
+        raise HTTPException(status_code=400, detail="history_hours must be between 0 and 2160")
+    if (position_liquidity is None) != (position_since is None):
+        raise HTTPException(status_code=400, detail="position_liquidity and position_since must be given together")
+    if position_liquidity is not None and position_liquidity <= 0:
+        raise HTTPException(status_code=400, detail="position_liquidity must be positive")
+
+    pair = db.query(*PAIR_COLUMNS).filter(models.Pair.launcher_id == pair_launcher_id).first()
+    if pair is None:
+        raise HTTPException(status_code=404, detail="Pair not found")
+
+    response = analytics.get_pair_liquidity_analytics(db, pair, int(time.time()), history_hours)
+    if position_liquidity is not None:
+        position = analytics.get_liquidity_position(db, pair, position_liquidity, position_since)
+        if position is None:
+            raise HTTPException(status_code=400, detail="The pair had no liquidity at position_since")
+        response["position"] = position
+    return FastJSONResponse(response)
+
+
+@app.get("/pair/{pair_launcher_id}/state")
+async def get_pair_state(
+    pair_launcher_id: str,
+    height: Optional[int] = None,
+    timestamp: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    # reserves and price after the pair's last transaction at or below a
+    # height (or block timestamp)
+    if height is not None and timestamp is not None:
+        raise HTTPException(status_code=400, detail="Use either height or timestamp, not both")
+
+    pair = db.query(models.Pair.launcher_id).filter(models.Pair.launcher_id == pair_launcher_id).first()
+    if pair is None:
+        raise HTTPException(status_code=404, detail="Pair not found")
+
+    last_transaction = analytics.get_state_at(db, pair_launcher_id, height, timestamp)
+
+    if last_transaction is None:
+        # before the pair's first transaction
+        state = {"xch": 0, "token": 0, "liquidity": 0}
+    else:
+        state = last_transaction.new_state
+
+    return FastJSONResponse({
+        "launcher_id": pair_launcher_id,
+        "height": last_transaction.height if last_transaction is not None else None,
+        "timestamp": last_transaction.timestamp if last_transaction is not None else None,
+        "pair_tx_index": last_transaction.pair_tx_index if last_transaction is not None else -1,
+        "xch_reserve": state["xch"],
+        "token_reserve": state["token"],
+        "liquidity": state["liquidity"],
+        "price": analytics.spot_price(state["xch"], state["token"]),
+    })
 
 
 @app.get("/transactions")
@@ -91,14 +388,8 @@ async def get_transactions(
     if limit > 420:
         raise HTTPException(status_code=400, detail="Limit cannot exceed 420")
 
-    # Perform an outer join between the Transaction and HeightToTimestamp tables
-    query = db.query(
-        models.Transaction, 
-        models.HeightToTimestamp.timestamp.label('timestamp')
-    ).outerjoin(
-        models.HeightToTimestamp,
-        models.Transaction.height == models.HeightToTimestamp.height
-    )
+    # block timestamps are stored on each transaction, so no join is needed
+    query = db.query(*TRANSACTION_RAW_COLUMNS)
 
     if pair_launcher_id:
         query = query.filter(models.Transaction.pair_launcher_id == pair_launcher_id)
@@ -113,10 +404,10 @@ async def get_transactions(
         query = query.filter(models.Transaction.height > after_height)
 
     if before_timestamp:
-        query = query.filter(models.HeightToTimestamp.timestamp < before_timestamp)
+        query = query.filter(models.Transaction.timestamp < before_timestamp)
 
     if after_timestamp:
-        query = query.filter(models.HeightToTimestamp.timestamp > after_timestamp)
+        query = query.filter(models.Transaction.timestamp > after_timestamp)
 
     if before_index:
         query = query.filter(models.Transaction.pair_tx_index < before_index)
@@ -124,27 +415,21 @@ async def get_transactions(
     if after_index:
         query = query.filter(models.Transaction.pair_tx_index > after_index)
 
+    if before_timestamp or after_timestamp:
+        # timestamps grow with height, so this is the same order, but it lets
+        # SQLite walk the timestamp index instead of sorting the whole range
+        query = query.order_by(desc(models.Transaction.timestamp), desc(models.Transaction.height))
+    else:
+        query = query.order_by(desc(models.Transaction.height))
+
     transactions = (
-        query.order_by(desc(models.Transaction.height))
+        query
         .limit(limit)
         .offset(offset)
         .all()
     )
 
-    # Convert the result into a list of dictionaries
-    transactions = [
-        {
-            **t[0].__dict__, 
-            'timestamp': t[1] or 0
-        } 
-        for t in transactions
-    ]
-
-    # # Remove the '_sa_instance_state' key which is added by SQLAlchemy
-    # for transaction in transactions:
-    #     transaction.pop('_sa_instance_state', None)
-
-    return transactions
+    return Response(content=transactions_to_json_bytes(transactions), media_type="application/json")
 
 
 @app.get("/stats")
@@ -182,35 +467,63 @@ async def get_24h_stats(db: Session = Depends(get_db)):
     one_day_ago = current_time - timedelta(hours=24)
     timestamp_24h_ago = int(time.mktime(one_day_ago.timetuple()))
 
-    item = db.query(models.HeightToTimestamp).filter(models.HeightToTimestamp.timestamp < timestamp_24h_ago).order_by(models.HeightToTimestamp.timestamp.desc()).first()
+    item = db.query(models.Transaction.coin_id).filter(models.Transaction.timestamp < timestamp_24h_ago).first()
 
     if item is None:
         return {"error": "No data found for the last 24 hours."}
 
-    height = item.height
-    pairs = await _get_pairs(db, wrap=False)
+    # price of a pair's first swap ever, for pairs without swaps in the window
+    first_swap = (
+        db.query(models.Transaction.state_change)
+        .filter(models.Transaction.pair_launcher_id == models.Pair.launcher_id)
+        .filter(models.Transaction.operation == "SWAP")
+        .order_by(models.Transaction.pair_tx_index)
+        .limit(1)
+        .correlate(models.Pair)
+        .scalar_subquery()
+    )
+    pairs = (
+        db.query(models.Pair.launcher_id, models.Pair.asset_id, first_swap.label("first_swap"))
+        .order_by(models.Pair.xch_reserve.desc())
+        .all()
+    )
+
+    # all swaps of the window in one streamed query (instead of one query per
+    # pair), aggregated as they are read: pair -> [trade_volume, vwap sum]
+    totals_by_pair = {}
+    swaps = (
+        db.query(models.Transaction.pair_launcher_id, models.Transaction.state_change)
+        .filter(models.Transaction.operation == "SWAP")
+        .filter(models.Transaction.timestamp >= timestamp_24h_ago)
+        .order_by(models.Transaction.pair_tx_index)
+        .yield_per(1000)
+    )
+    for swap in swaps:
+        totals = totals_by_pair.get(swap.pair_launcher_id)
+        if totals is None:
+            totals = totals_by_pair[swap.pair_launcher_id] = [0, 0]
+        xch_change = abs(swap.state_change["xch"])
+        totals[0] += xch_change
+        totals[1] += xch_change * xch_change / abs(swap.state_change["token"])
+
     total_trade_volume = 0
     total_trade_volume_usd = 0
 
     pair_info = []
 
     for pair in pairs:
-        transactions = db.query(models.Transaction).filter(models.Transaction.pair_launcher_id == pair.launcher_id).filter(models.Transaction.operation == "SWAP").filter(models.Transaction.height > height).all()
+        totals = totals_by_pair.get(pair.launcher_id)
 
         trade_volume = 0
         trade_volume_usd = 0
         xch_per_token_vwap = 0
 
-        if len(transactions) == 0:
-            transaction = db.query(models.Transaction).filter(models.Transaction.pair_launcher_id == pair.launcher_id).filter(models.Transaction.operation == "SWAP").first()
-            if transaction is not None:
-                xch_per_token_vwap = - transaction.state_change["xch"] / transaction.state_change["token"]
+        if totals is None:
+            if pair.first_swap is not None:
+                xch_per_token_vwap = - pair.first_swap["xch"] / pair.first_swap["token"]
         else:
-            for transaction in transactions:
-                trade_volume += abs(transaction.state_change["xch"])
-                xch_per_token_vwap += abs(transaction.state_change["xch"]) * abs(transaction.state_change["xch"]) / abs(transaction.state_change["token"])
-        
-            xch_per_token_vwap /= trade_volume
+            trade_volume = totals[0]
+            xch_per_token_vwap = totals[1] / trade_volume
             total_trade_volume += trade_volume
 
         pair_info.append({
@@ -220,12 +533,128 @@ async def get_24h_stats(db: Session = Depends(get_db)):
             "xch_per_token_vwap": xch_per_token_vwap
         })
 
-    return {
+    return FastJSONResponse({
         "total_trade_volume": total_trade_volume,
         "pair_info": pair_info
-    }
+    })
+
+
+# /leaderboard/{metric} sort keys; window stats are ranked from their own
+# indexes, TVL from the pairs' XCH reserves
+LEADERBOARD_SORT_KEYS = {
+    "trade_volume": models.PairWindowStats.trade_volume,
+    "transaction_count": models.PairWindowStats.transaction_count,
+    "price_change": models.PairWindowStats.price_change,
+    "tvl": models.Pair.xch_reserve,
+}
+MAX_LEADERBOARD_LIMIT = 100
+
+
+@app.get("/leaderboard/{metric}")
+async def get_leaderboard(
+    metric: str,
+    window: str = "24h",
+    order: str = "desc",
+    limit: int = 10,
+    db: Session = Depends(get_db)
+):
+    # top pairs by trade volume, transaction count or price change over the
+    # window (1h, 24h or 7d), or by TVL; see leaderboard.py
+    sort_key = LEADERBOARD_SORT_KEYS.get(metric)
+    if sort_key is None:
+        raise HTTPException(status_code=404, detail=f"metric must be one of: {', '.join(LEADERBOARD_SORT_KEYS)}")
+    if window not in leaderboard.LEADERBOARD_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window must be one of: {', '.join(leaderboard.LEADERBOARD_WINDOWS)}")
+    if order not in ["asc", "desc"]:
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+    if limit < 1 or limit > MAX_LEADERBOARD_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_LEADERBOARD_LIMIT}")
+
+    window_stats = and_(
+        models.PairWindowStats.pair_launcher_id == models.Pair.launcher_id,
+        models.PairWindowStats.period == window,
+    )
+    query = db.query(
+        *PAIR_COLUMNS,
+        models.PairWindowStats.transaction_count.label("window_transaction_count"),
+        models.PairWindowStats.trade_volume.label("window_trade_volume"),
+        models.PairWindowStats.price_change.label("window_price_change"),
+    )
+    if metric == "tvl":
+        # pairs without transactions have no window stats yet; ordered like
+        # /pairs, by idx_pairs_xch_reserve alone
+        query = query.select_from(models.Pair).outerjoin(models.PairWindowStats, window_stats)
+        order_by = [sort_key]
+    else:
+        query = query.select_from(models.PairWindowStats).join(models.Pair, window_stats).filter(sort_key.isnot(None))
+        # matches the (period, metric, pair_launcher_id) indexes
+        order_by = [sort_key, models.PairWindowStats.pair_launcher_id]
+
+    if order == "desc":
+        query = query.order_by(*[column.desc() for column in order_by])
+    else:
+        query = query.order_by(*[column.asc() for column in order_by])
+
+    return FastJSONResponse({
+        "metric": metric,
+        "window": window,
+        "pairs": [
+            {
+                "rank": rank,
+                "pair": pair_to_json(row),
+                "tvl": 2 * int(row.xch_reserve),
+                "transaction_count": row.window_transaction_count or 0,
+                "trade_volume": row.window_trade_volume or 0,
+                "price_change": row.window_price_change,
+            }
+            for rank, row in enumerate(query.limit(limit).all(), start=1)
+        ],
+    })
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/export/transactions")
+async def export_transactions(
+    format: str = "ndjson",
+    pair_launcher_id: Optional[str] = None,
+    from_height: Optional[int] = None,
+    to_height: Optional[int] = None
+):
+    # full history in one streamed response, instead of paging /transactions
+    if format not in ["ndjson", "csv"]:
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+
+    def generate():
+        # own session: it has to outlive the request handler
+        db = database.SessionLocal()
+        try:
+            rows = export.iter_export_rows(db, pair_launcher_id, from_height, to_height)
+            yield from export.iter_ndjson(rows) if format == "ndjson" else export.iter_csv(rows)
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson" if format == "ndjson" else "text/csv",
+        headers={"Content-Disposition": f'attachment; filename="transactions.{format}"'}
+    )
 
 
+@app.get("/stream")
+async def get_stream(pair_launcher_id: Optional[str] = None):
+    # server-sent events: 'transactions' and 'pair' after every committed sync
+    # chunk, 'rollback' after a reorg, from all sync workers (relayed through
+    # stream_events, see stream.py); optionally limited to a single pair
+    return StreamingResponse(
+        stream.hub.events(pair_launcher_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 @app.get("/")
 async def root():
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+API load test with a synthetic data generator.
+
+Fill a database with N pairs and M transactions (Zipf-skewed across pairs),
+their block heights/timestamps (ending now) and hourly USD prices:
+```
+python bench_api.py generate bench.db [pairs] [transactions]
+```
+
+Serve it and drive the read endpoints at several concurrency levels,
+reporting p50/p99 latency and throughput per endpoint:
+```
+DATABASE_URL=sqlite:///./bench.db uvicorn main:app --port 8000
+python bench_api.py run http://localhost:8000 [concurrency,...] [seconds]
+```
+
+Measure latency and Python heap allocation (tracemalloc peak while the
+requests are in flight) per endpoint, in-process and without a server:
+```
+python bench_api.py memory bench.db [concurrency,...] [requests]
+```
+
+Measure how fast a fresh API process starts: time to import main.py, time
+to serve its first request and peak RSS, each in a new interpreter:
+```
+python bench_api.py startup bench.db [runs]
+```
+"""
+
+from sqlalchemy import create_engine
+import statistics
+import asyncio
+import random
+import time
+import sys
+import os
+
+TRANSACTION_BATCH_SIZE = 50000
+SECONDS_PER_BLOCK = 18.75
+
+
+def random_hex(rng: random.Random) -> str:
+    return "%064x" % rng.getrandbits(256)
+
+
+def pair_weights(pairs: int):
+    # a few very busy pairs and a long tail of quiet ones
+    return [1 / (i + 1) ** 1.1 for i in range(pairs)]
+
+
+def generate(db_path: str, pairs: int, transactions: int, seed: int = 42):
+    import models, database
+
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite:///{db_path}")
+    database.Base.metadata.create_all(bind=engine)
+
+    now = int(time.time())
+    first_height = 3_000_000
+    blocks = max(transactions // 2, 1)
+    first_timestamp = now - int(blocks * SECONDS_PER_BLOCK)
+
+    pair_rows = []
+    for i in range(pairs):
+        pair_rows.append({
+            "launcher_id": random_hex(rng),
+            "name": f"Synthetic Token {i}",
+            "short_name": f"SYN{i}",
+            "image_url": "",
+            "asset_id": random_hex(rng),
+            "hidden_puzzle_hash": None,
+            "inverse_fee": 993,
+            "current_coin_id": random_hex(rng),
+            "xch_reserve": 0,
+            "token_reserve": 0,
+            "liquidity": 0,
+            "trade_volume": "0",
+            "trade_volume_usd": "0",
+            "last_tx_index": -1,
+        })
+    states = [{"xch": 0, "token": 0, "liquidity": 0} for _ in range(pairs)]
+    volumes = [0] * pairs
+
+    print(f"Generating {transactions} transactions over {pairs} pairs and {blocks} blocks...")
+    weights = pair_weights(pairs)
+    heights = set()
+    with engine.begin() as conn:
+        conn.execute(models.Router.__table__.insert(), [
+            {"launcher_id": random_hex(rng), "current_coin_id": random_hex(rng), "rcat": False},
+            {"launcher_id": random_hex(rng), "current_coin_id": random_hex(rng), "rcat": True},
+        ])
+
+    rows = []
+    for n in range(transactions):
+        pair_index = rng.choices(range(pairs), weights)[0]
+        pair = pair_rows[pair_index]
+        state = states[pair_index]
+        height = first_height + n * blocks // transactions
+
+        roll = rng.random()
+        if state["liquidity"] == 0 or roll < 0.10:
+            xch = rng.randint(10 ** 11, 10 ** 13)
+            token = xch * rng.randint(500, 2000) // 10 ** 9
+            change = {"xch": xch, "token": token, "liquidity": xch}
+            operation = "ADD_LIQUIDITY"
+        elif roll < 0.15:
+            share = rng.randint(1, 20)
+            change = {
+                "xch": -state["xch"] * share // 100,
+                "token": -state["token"] * share // 100,
+                "liquidity": -state["liquidity"] * share // 100,
+            }
+            operation = "REMOVE_LIQUIDITY"
+        else:
+            xch = rng.randint(1, max(state["xch"] // 20, 1))
+            token = xch * state["token"] // max(state["xch"], 1)
+            change = {"xch": xch, "token": -token, "liquidity": 0} if rng.random() < 0.5 else \
+                {"xch": -xch, "token": token, "liquidity": 0}
+            operation = "SWAP"
+            volumes[pair_index] += xch
+
+        for key in state:
+            state[key] += change[key]
+
+        pair["last_tx_index"] += 1
+        heights.add(height)
+        rows.append({
+            "coin_id": random_hex(rng),
+            "pair_launcher_id": pair["launcher_id"],
+            "operation": operation,
+            "state_change": change,
+            "new_state": dict(state),
+            "height": height,
+            "pair_tx_index": pair["last_tx_index"],
+            "timestamp": first_timestamp + int((height - first_height) * SECONDS_PER_BLOCK),
+        })
+
+        if len(rows) >= TRANSACTION_BATCH_SIZE:
+            with engine.begin() as conn:
+                conn.execute(models.Transaction.__table__.insert(), rows)
+            rows = []
+            print(f"  {n + 1} transactions written")
+
+    if len(rows) > 0:
+        with engine.begin() as conn:
+            conn.execute(models.Transaction.__table__.insert(), rows)
+
+    for pair, state, volume in zip(pair_rows, states, volumes):
+        pair["xch_reserve"] = state["xch"]
+        pair["token_reserve"] = state["token"]
+        pair["liquidity"] = state["liquidity"]
+        pair["trade_volume"] = str(volume)
+        pair["trade_volume_usd"] = str(volume * 3000 // 10 ** 12)
+
+    first_hour = first_timestamp // 3600 * 3600
+    with engine.begin() as conn:
+        conn.execute(models.Pair.__table__.insert(), pair_rows)
+        conn.execute(models.HeightToTimestamp.__table__.insert(), [
+            {"height": h, "timestamp": first_timestamp + int((h - first_height) * SECONDS_PER_BLOCK)}
+            for h in sorted(heights)
+        ])
+        conn.execute(models.AverageUsdPrice.__table__.insert(), [
+            {"from_timestamp": t, "to_timestamp": t + 3600, "price_cents": rng.randint(1000, 5000)}
+            for t in range(first_hour, now // 3600 * 3600 - 3600, 3600)
+        ])
+
+    # aggregates the syncer maintains (/pair/{id}/analytics, /leaderboard)
+    import analytics, leaderboard
+    db = database.SessionLocal(bind=engine)
+    for pair in db.query(models.Pair.launcher_id, models.Pair.inverse_fee).all():
+        analytics.rebuild_hourly_stats(db, pair)
+        db.commit()
+    leaderboard.rebuild(db, now)
+    db.close()
+
+    print(f"Wrote {pairs} pairs, {transactions} transactions and {len(heights)} heights to {db_path}")
+
+
+def build_scenarios(pairs: list, transactions: int) -> dict:
+    hot_pair = pairs[0]["launcher_id"] if pairs else ""
+    now = int(time.time())
+    return {
+        "transactions": "/transactions",
+        "transactions?pair": f"/transactions?pair_launcher_id={hot_pair}",
+        "transactions?operation": "/transactions?operation=SWAP&limit=100",
+        "transactions?timestamp": f"/transactions?after_timestamp={now - 7 * 24 * 3600}&before_timestamp={now - 24 * 3600}",
+        "transactions?deep_offset": f"/transactions?limit=420&offset={max(transactions - 1000, 0)}",
+        "24h-stats": "/24h-stats",
+        "stats": "/stats",
+        "pairs": "/pairs",
+        "leaderboard": "/leaderboard/trade_volume?window=24h",
+        "pair/liquidity": f"/pair/{hot_pair}/liquidity",
+        "pair-puzzle-hashes": "/pair-puzzle-hashes",
+    }
+
+
+async def drive(session, url: str, concurrency: int, seconds: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values: list, p: float) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(p) - 1]
+
+
+async def run(base_url: str, concurrency_levels: list, seconds: float):
+    import aiohttp
+
+    base_url = base_url.rstrip("/")
+    connector = aiohttp.TCPConnector(limit=max(concurrency_levels))
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async with session.get(base_url + "/pairs") as response:
+            pairs = await response.json()
+        async with session.get(base_url + "/stats") as response:
+            transactions = (await response.json())["transaction_count"]
+
+        print(f"{'endpoint':<26} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for name, path in build_scenarios(pairs, transactions).items():
+            for concurrency in concurrency_levels:
+                latencies, errors, elapsed = await drive(session, base_url + path, concurrency, seconds)
+                print(
+                    f"{name:<26} {concurrency:>5} {len(latencies) / elapsed:>9.1f} "
+                    f"{percentile(latencies, 50) * 1000:>9.1f} {percentile(latencies, 99) * 1000:>9.1f} {errors:>7}"
+                )
+
+
+async def asgi_get(app, url: str) -> int:
+    # minimal ASGI client; returns the status code
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "client": ("bench", 0),
+        "server": ("bench", 80),
+    }
+    status = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def measure_memory(db_path: str, concurrency_levels: list, requests: int):
+    import tracemalloc
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    from fastapi import FastAPI
+    import models, database, api
+
+    app = FastAPI()
+    app.include_router(api.app)
+    db = database.SessionLocal()
+    pairs = [{"launcher_id": launcher_id} for (launcher_id,) in db.query(models.Pair.launcher_id).order_by(models.Pair.xch_reserve.desc()).all()]
+    transactions = db.query(models.Transaction).count()
+    db.close()
+
+    async def batch(url: str, concurrency: int):
+        for _ in range(max(requests // concurrency, 1)):
+            statuses = await asyncio.gather(*[asgi_get(app, url) for _ in range(concurrency)])
+            if any(status != 200 for status in statuses):
+                raise ValueError(f"{url} returned {statuses}")
+
+    print(f"{'endpoint':<26} {'conc':>5} {'mean ms':>9} {'peak KiB':>10} {'KiB/req':>9}")
+    for name, path in build_scenarios(pairs, transactions).items():
+        for concurrency in concurrency_levels:
+            # warm-up (caches, compiled statements), then latency without tracing
+            await batch(path, concurrency)
+            start = time.perf_counter()
+            await batch(path, concurrency)
+            elapsed = time.perf_counter() - start
+            batches = max(requests // concurrency, 1)
+
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            await asyncio.gather(*[asgi_get(app, path) for _ in range(concurrency)])
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            tracemalloc.stop()
+
+            print(
+                f"{name:<26} {concurrency:>5} {elapsed / (batches * concurrency) * 1000:>9.2f} "
+                f"{peak / 1024:>10.0f} {peak / 1024 / concurrency:>9.0f}"
+            )
+
+
+# run in a fresh interpreter by measure_startup; prints one JSON line
+STARTUP_PROBE = """
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+import asyncio, json, resource, sys
+import bench_api
+status = asyncio.run(bench_api.asgi_get(main.app, "/pairs"))
+print(json.dumps({
+    "import": imported - start,
+    "first_request": time.perf_counter() - imported,
+    "status": status,
+    "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "chia_modules": sum(1 for name in sys.modules if name.split(".")[0] == "chia"),
+}))
+"""
+
+
+def measure_startup(db_path: str, runs: int):
+    import subprocess
+    import json
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    if any(result["status"] != 200 for result in results):
+        raise ValueError(f"/pairs returned {[result['status'] for result in results]}")
+    print(f"{'import ms':>10} {'first req ms':>13} {'max RSS MiB':>12} {'modules':>8} {'chia modules':>13}  (median of {runs})")
+    print(
+        f"{statistics.median(r['import'] for r in results) * 1000:>10.0f} "
+        f"{statistics.median(r['first_request'] for r in results) * 1000:>13.0f} "
+        f"{statistics.median(r['max_rss_kib'] for r in results) / 1024:>12.1f} "
+        f"{results[0]['modules']:>8} {results[0]['chia_modules']:>13}"
+    )
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ["generate", "run", "memory", "startup"]:
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == "generate":
+        pairs = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+        transactions = int(sys.argv[4]) if len(sys.argv) > 4 else 1_000_000
+        generate(os.path.abspath(sys.argv[2]), pairs, transactions)
+    elif sys.argv[1] == "memory":
+        concurrency_levels = [int(c) for c in sys.argv[3].split(",")] if len(sys.argv) > 3 else [1, 8, 32]
+        requests = int(sys.argv[4]) if len(sys.argv) > 4 else 64
+        asyncio.run(measure_memory(os.path.abspath(sys.argv[2]), concurrency_levels, requests))
+    elif sys.argv[1] == "startup":
+        measure_startup(os.path.abspath(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 5)
+    else:
+        concurrency_levels = [int(c) for c in sys.argv[3].split(",")] if len(sys.argv) > 3 else [1, 8, 32]
+        seconds = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+        asyncio.run(run(sys.argv[2], concurrency_levels, seconds))
+
+
+if __name__ == "__main__":
+    main()
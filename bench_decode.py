@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for pair spend decoding (see pair_spend.py).
+
+Record the spends of a pair once (needs COINSET_URL):
+```
+python bench_decode.py record <pair_launcher_id> spends.jsonl [max_spends]
+```
+
+Then compare the legacy decoding path with the cached one, offline:
+```
+python bench_decode.py run spends.jsonl [rounds]
+```
+"""
+
+from chia.wallet.puzzles.singleton_top_layer_v1_1 import SINGLETON_LAUNCHER_HASH
+from chia.consensus.condition_tools import conditions_dict_for_solution
+from chia.types.blockchain_format.program import INFINITE_COST
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.types.blockchain_format.program import Program
+from chia_rs import Coin, CoinSpend
+from dotenv import load_dotenv
+import pair_spend
+import asyncio
+import json
+import time
+import sys
+import os
+
+
+def legacy_decode(creation_spend: CoinSpend):
+    """The decoding sync_pair used before pair_spend was introduced."""
+    conditions_dict = conditions_dict_for_solution(
+        creation_spend.puzzle_reveal,
+        creation_spend.solution,
+        INFINITE_COST
+    )
+
+    try:
+        old_state = creation_spend.puzzle_reveal.uncurry()[1].at("rf").uncurry()[
+            1].at("rrf")
+    except:
+        old_state = Program.from_bytes(creation_spend.puzzle_reveal.to_bytes()).uncurry()[1].at("rf").uncurry()[
+            1].at("rrf")
+    p2_merkle_solution = None
+    try:
+        p2_merkle_solution = creation_spend.solution.to_program().at("rrf")
+    except:
+        p2_merkle_solution = Program.from_bytes(creation_spend.solution.to_bytes()).at("rrf")
+    new_state_puzzle = p2_merkle_solution.at("f")
+    params = p2_merkle_solution.at("rrf").at("r")
+
+    new_state_puzzle_sol = Program.to([
+        old_state,
+        params,
+        pair_spend.DUMMY_SINGLETON_STRUCT,
+        pair_spend.DUMMY_COIN_ID
+    ])
+    new_state = new_state_puzzle.run(new_state_puzzle_sol).at("f")
+
+    next_coin_id = None
+    for cwa in conditions_dict.get(ConditionOpcode.CREATE_COIN, []):
+        if cwa.vars[1] == b"\x01":
+            next_coin_id = Coin(creation_spend.coin.name(), cwa.vars[0], 1).name()
+
+    return old_state, new_state, next_coin_id
+
+
+async def record(pair_launcher_id: str, output_file: str, max_spends: int):
+    import sync
+    sync.ensure_client()
+    client = sync.client
+
+    current_coin_id = bytes.fromhex(pair_launcher_id)
+    coin_record = await client.get_coin_record_by_name(current_coin_id)
+    if coin_record.coin.puzzle_hash == SINGLETON_LAUNCHER_HASH:
+        launcher_spend = await client.get_puzzle_and_solution(current_coin_id, coin_record.spent_block_index)
+        conditions_dict = conditions_dict_for_solution(
+            launcher_spend.puzzle_reveal,
+            launcher_spend.solution,
+            INFINITE_COST
+        )
+        current_coin_id = Coin(current_coin_id, conditions_dict[ConditionOpcode.CREATE_COIN][0].vars[0], 1).name()
+        coin_record = await client.get_coin_record_by_name(current_coin_id)
+
+    recorded = 0
+    with open(output_file, "w") as f:
+        while coin_record.spent and recorded < max_spends:
+            coin_spend = await client.get_puzzle_and_solution(current_coin_id, coin_record.spent_block_index)
+            f.write(json.dumps({"coin_spend": coin_spend.to_json_dict()}) + "\n")
+            recorded += 1
+
+            current_coin_id = legacy_decode(coin_spend)[2]
+            coin_record = await client.get_coin_record_by_name(current_coin_id)
+
+    await client.session.close()
+    print(f"Recorded {recorded} spends to {output_file}")
+
+
+def load_spends(input_file: str):
+    spends = []
+    with open(input_file) as f:
+        for line in f:
+            if line.strip():
+                spends.append(CoinSpend.from_json_dict(json.loads(line)["coin_spend"]))
+    return spends
+
+
+def time_decoder(name: str, decode, spends, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for coin_spend in spends:
+            decode(coin_spend)
+    elapsed = time.perf_counter() - start
+
+    per_spend_us = elapsed / (rounds * len(spends)) * 10 ** 6
+    print(f"{name:>8}: {per_spend_us:10.1f} us/spend ({rounds * len(spends)} spends in {elapsed:.2f}s)")
+    return per_spend_us
+
+
+def run(input_file: str, rounds: int):
+    spends = load_spends(input_file)
+    if len(spends) == 0:
+        print("No spends to benchmark")
+        return
+    print(f"Loaded {len(spends)} recorded spends")
+
+    # both paths must agree before timing means anything
+    for coin_spend in spends:
+        expected = legacy_decode(coin_spend)
+        actual = pair_spend.decode_pair_spend(coin_spend.coin, coin_spend.puzzle_reveal, coin_spend.solution)
+        assert expected[0] == actual.old_state, f"old state mismatch for {coin_spend.coin.name().hex()}"
+        assert expected[1] == actual.new_state, f"new state mismatch for {coin_spend.coin.name().hex()}"
+        assert expected[2] == actual.next_coin_id, f"next coin mismatch for {coin_spend.coin.name().hex()}"
+
+    legacy_us = time_decoder("legacy", legacy_decode, spends, rounds)
+    cached_us = time_decoder("cached", lambda cs: pair_spend.decode_pair_spend(cs.coin, cs.puzzle_reveal, cs.solution), spends, rounds)
+    print(f"Speedup: {legacy_us / cached_us:.2f}x")
+    print(f"Templates: {pair_spend.template_cache}")
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ["record", "run"]:
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == "record":
+        if os.environ.get("COINSET_URL") is None:
+            load_dotenv()
+        max_spends = int(sys.argv[4]) if len(sys.argv) > 4 else 1000
+        asyncio.run(record(sys.argv[2], sys.argv[3], max_spends))
+    else:
+        rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+        run(sys.argv[2], rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the sync pipeline (sync_router + sync_pair).
+
+First record real full node responses once (needs COINSET_URL and the router
+launcher ids, e.g. from .env); only the first [max_pairs] pairs are synced:
+```
+python bench_sync.py record rpc_recording/ [max_pairs]
+```
+
+Then replay them as often as needed, without network access:
+```
+python bench_sync.py run rpc_recording/ [max_pairs]
+```
+
+Each run syncs into a fresh temporary database and reports spends per second,
+RPC calls per spend and peak (Python) memory for the router walk and for the
+pair walks separately.
+"""
+
+from dotenv import load_dotenv
+import tracemalloc
+import tempfile
+import asyncio
+import time
+import sys
+import os
+
+
+def print_phase(name: str, seconds: float, spends: int, request_counts: dict, peak_memory: int):
+    calls = sum(request_counts.values())
+    print(f"\n{name}")
+    print(f"  spends:            {spends}")
+    print(f"  time:              {seconds:.2f}s")
+    if spends > 0:
+        print(f"  spends/s:          {spends / seconds:.1f}")
+        print(f"  RPC calls/spend:   {calls / spends:.2f}")
+    for method, count in sorted(request_counts.items()):
+        print(f"    {method + ':':<34} {count}")
+    print(f"  peak memory:       {peak_memory / 1024 / 1024:.1f} MiB")
+
+
+def diff_counts(after: dict, before: dict) -> dict:
+    return {method: count - before.get(method, 0) for method, count in after.items() if count - before.get(method, 0) > 0}
+
+
+async def run_sync(max_pairs: int):
+    import models, database, sync
+    database.init_db()
+    sync.ensure_client()
+    client = sync.client
+    db = database.SessionLocal()
+
+    max_height = await sync.get_confirmed_height()
+    # one sync cycle, as in main.py
+    client.start_cycle(max_height)
+
+    # router walks
+    counts_before = dict(client.request_counts)
+    tracemalloc.start()
+    start = time.perf_counter()
+    router_spends = 0
+    for rcat in [False, True]:
+        current_router = db.query(models.Router).filter(models.Router.rcat == rcat).first()
+        new_router, new_pairs = await sync.sync_router(current_router, max_height)
+        if new_router is not None:
+            db.commit()
+        for new_pair in new_pairs:
+            db.add(new_pair)
+            db.commit()
+        # one router spend per deployed pair, plus the launcher spend
+        router_spends += len(new_pairs)
+    router_seconds = time.perf_counter() - start
+    _, router_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print_phase("sync_router", router_seconds, router_spends, diff_counts(client.request_counts, counts_before), router_peak)
+
+    # pair walks
+    pairs = db.query(models.Pair).order_by(models.Pair.launcher_id).limit(max_pairs).all()
+    counts_before = dict(client.request_counts)
+    tracemalloc.start()
+    start = time.perf_counter()
+    pair_spends = 0
+    for pair in pairs:
+        async for new_pair, new_transactions, new_heights in sync.sync_pair(pair, max_height):
+            sync.commit_pair_chunk(db, new_pair, new_transactions, new_heights)
+            pair_spends += len(new_transactions)
+    pair_seconds = time.perf_counter() - start
+    _, pair_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print_phase(f"sync_pair ({len(pairs)} pairs)", pair_seconds, pair_spends, diff_counts(client.request_counts, counts_before), pair_peak)
+
+    db.close()
+    await client.session.close()
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ["record", "run"]:
+        print(__doc__)
+        sys.exit(1)
+
+    load_dotenv()
+    recording_dir = os.path.abspath(sys.argv[2])
+    max_pairs = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    if sys.argv[1] == "record":
+        os.environ["RPC_RECORD_DIR"] = recording_dir
+    else:
+        os.environ["RPC_REPLAY_DIR"] = recording_dir
+        os.environ.setdefault("COINSET_URL", "http://replay/")
+
+    # token metadata lookups are not part of the sync pipeline being measured
+    os.environ["DEXIE_TOKEN_URL"] = "http://localhost:9/"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # never the configured database (DATABASE_URL may be absolute, e.g.
+        # from .env); database reads it on import, in run_sync
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/bench.db"
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        os.chdir(tmp_dir)
+        asyncio.run(run_sync(max_pairs))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,42 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, tuple_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-import os, models
+import os
 
-DATABASE_URL = "sqlite:///./database.db"
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./database.db")
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, pool_size=20, max_overflow=30)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+
+def iter_in_pages(query, order_by: list, page_size: int):
+    # Keyset pagination over `query` in `order_by` order (unique together).
+    # Every page is a complete query of its own, so no read stays open while
+    # the caller handles the rows: a streaming cursor (yield_per) would hold
+    # SQLite's read lock, and thereby block all writers, until it is done.
+    last_key = None
+    while True:
+        page = query
+        if last_key is not None:
+            page = page.filter(tuple_(*order_by) > tuple_(*last_key))
+        rows = page.order_by(*order_by).limit(page_size).all()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_key = [getattr(rows[-1], column.key) for column in order_by]
+
 def init_db():
+    # models import this module (for Base), so it is only imported here; that
+    # way either module can be imported first
+    import models
+
     session = SessionLocal()
 
-    # Create database tables
-    Base.metadata.create_all(bind=engine)
+    # Create missing tables and apply pending schema migrations
+    import migrate
+    migrate.run_migrations(engine)
 
     # Normal router
     router_exists = session.query(models.Router).filter(models.Router.rcat == False).first()
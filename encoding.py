@@ -0,0 +1,28 @@
+from fastapi import Response
+
+# orjson serializes several times faster than the standard library; it is
+# optional, so the API still works (just slower) without it
+import json
+
+try:
+    import orjson
+
+    def dumps(content) -> bytes:
+        try:
+            return orjson.dumps(content)
+        except orjson.JSONEncodeError:
+            # orjson only handles 64-bit integers; token amounts and reserves
+            # can exceed that, the standard library has no limit
+            return json.dumps(content, separators=(",", ":")).encode()
+except ImportError:
+    def dumps(content) -> bytes:
+        return json.dumps(content, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(Response):
+    # content must already be plain JSON types (dicts, lists, str, int, ...);
+    # unlike the default response, it is not passed through jsonable_encoder
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Bulk transaction history export (all pairs, or a single pair and/or height
+range), with block timestamps and the hourly XCH/USD price.
+
+```
+python export.py transactions.ndjson [--pair=<launcher_id>] [--from-height=N] [--to-height=N]
+python export.py transactions.csv ...
+python export.py transactions.parquet ...   # needs pyarrow
+python export.py - --format=csv ...         # to stdout
+```
+
+The API serves the same data as NDJSON or CSV from `/export/transactions`.
+Rows are read in pages of EXPORT_BATCH_SIZE, each with its own short query,
+so memory use stays constant regardless of the history size and a slow
+client never holds a read lock the sync would have to wait for. Rows
+committed while an export runs are included if they sort after the current
+page.
+"""
+
+from typing import Iterator, Optional
+from dotenv import load_dotenv
+import bisect
+import csv
+import io
+import os
+import sys
+
+import encoding
+
+EXPORT_FIELDS = [
+    "coin_id",
+    "pair_launcher_id",
+    "pair_tx_index",
+    "operation",
+    "height",
+    "timestamp",
+    "xch_change",
+    "token_change",
+    "liquidity_change",
+    "xch_reserve",
+    "token_reserve",
+    "liquidity",
+    "xch_price_cents",
+    "usd_volume_cents",
+]
+
+EXPORT_FORMATS = ["ndjson", "csv", "parquet"]
+
+EXPORT_BATCH_SIZE = 5000
+
+
+class PriceLookup:
+    # hourly prices are small enough to keep in memory (~9k rows per year),
+    # which is much cheaper than a range join per transaction
+    def __init__(self, db):
+        import models
+
+        prices = (
+            db.query(models.AverageUsdPrice.from_timestamp, models.AverageUsdPrice.to_timestamp, models.AverageUsdPrice.price_cents)
+            .order_by(models.AverageUsdPrice.from_timestamp)
+            .all()
+        )
+        self.from_timestamps = [price.from_timestamp for price in prices]
+        self.prices = prices
+
+    def price_cents_at(self, timestamp: Optional[int]) -> Optional[int]:
+        if not timestamp:
+            return None
+
+        index = bisect.bisect_right(self.from_timestamps, timestamp) - 1
+        if index < 0 or self.prices[index].to_timestamp <= timestamp:
+            return None
+        return self.prices[index].price_cents
+
+
+def iter_export_rows(
+    db,
+    pair_launcher_id: Optional[str] = None,
+    from_height: Optional[int] = None,
+    to_height: Optional[int] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[dict]:
+    import models, database
+
+    price_lookup = PriceLookup(db)
+
+    query = db.query(
+        models.Transaction.coin_id,
+        models.Transaction.pair_launcher_id,
+        models.Transaction.pair_tx_index,
+        models.Transaction.operation,
+        models.Transaction.height,
+        models.Transaction.timestamp,
+        models.Transaction.state_change,
+        models.Transaction.new_state,
+    )
+
+    if pair_launcher_id is not None:
+        query = query.filter(models.Transaction.pair_launcher_id == pair_launcher_id)
+    if from_height is not None:
+        query = query.filter(models.Transaction.height >= from_height)
+    if to_height is not None:
+        query = query.filter(models.Transaction.height <= to_height)
+
+    if pair_launcher_id is not None:
+        order_by = [models.Transaction.pair_tx_index]
+    else:
+        order_by = [models.Transaction.height, models.Transaction.pair_launcher_id, models.Transaction.pair_tx_index]
+
+    # the response may be read slowly; pages keep the sync from waiting on it
+    for row in database.iter_in_pages(query, order_by, batch_size):
+        price_cents = price_lookup.price_cents_at(row.timestamp)
+        usd_volume_cents = None
+        if row.operation == "SWAP" and price_cents is not None:
+            # same rounding as usd_price_sync
+            usd_volume_cents = abs(row.state_change["xch"]) * price_cents // 10 ** 12
+
+        yield {
+            "coin_id": row.coin_id,
+            "pair_launcher_id": row.pair_launcher_id,
+            "pair_tx_index": row.pair_tx_index,
+            "operation": row.operation,
+            "height": row.height,
+            "timestamp": row.timestamp,
+            "xch_change": row.state_change["xch"],
+            "token_change": row.state_change["token"],
+            "liquidity_change": row.state_change["liquidity"],
+            "xch_reserve": row.new_state["xch"],
+            "token_reserve": row.new_state["token"],
+            "liquidity": row.new_state["liquidity"],
+            "xch_price_cents": price_cents,
+            "usd_volume_cents": usd_volume_cents,
+        }
+
+
+def iter_ndjson(rows: Iterator[dict], rows_per_chunk: int = 1000) -> Iterator[bytes]:
+    chunk = []
+    for row in rows:
+        chunk.append(encoding.dumps(row))
+        if len(chunk) >= rows_per_chunk:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+
+    if len(chunk) > 0:
+        yield b"\n".join(chunk) + b"\n"
+
+
+def iter_csv(rows: Iterator[dict], rows_per_chunk: int = 1000) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator="\n")
+    writer.writeheader()
+
+    for i, row in enumerate(rows):
+        writer.writerow(row)
+        if (i + 1) % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell() > 0:
+        yield buffer.getvalue()
+
+
+def write_parquet(rows: Iterator[dict], path: str, row_group_size: int = 100000) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    # amounts (mojos, reserves) can exceed int64, so they are stored as strings
+    int_fields = ["pair_tx_index", "height", "timestamp", "xch_price_cents"]
+    schema = pa.schema([
+        (field, pa.int64() if field in int_fields else pa.string())
+        for field in EXPORT_FIELDS
+    ])
+
+    def flush(writer, batch):
+        columns = {
+            field: [
+                row[field] if field in int_fields or row[field] is None else str(row[field])
+                for row in batch
+            ]
+            for field in EXPORT_FIELDS
+        }
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+    count = 0
+    batch = []
+    with pq.ParquetWriter(path, schema) as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                flush(writer, batch)
+                count += len(batch)
+                batch = []
+
+        if len(batch) > 0:
+            flush(writer, batch)
+            count += len(batch)
+
+    return count
+
+
+def parse_option(args: list, name: str) -> Optional[str]:
+    for arg in args:
+        if arg.startswith(f"--{name}="):
+            return arg.split("=", 1)[1]
+    return None
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1].startswith("--"):
+        print(__doc__)
+        sys.exit(1)
+
+    load_dotenv()
+    import models, database
+
+    output_path = sys.argv[1]
+    options = sys.argv[2:]
+    export_format = parse_option(options, "format") or os.path.splitext(output_path)[1].lstrip(".")
+    if export_format not in EXPORT_FORMATS:
+        print(f"Unknown format '{export_format}'; use --format={'|'.join(EXPORT_FORMATS)}")
+        sys.exit(1)
+
+    from_height = parse_option(options, "from-height")
+    to_height = parse_option(options, "to-height")
+
+    db = database.SessionLocal()
+    try:
+        rows = iter_export_rows(
+            db,
+            pair_launcher_id=parse_option(options, "pair"),
+            from_height=int(from_height) if from_height is not None else None,
+            to_height=int(to_height) if to_height is not None else None,
+        )
+
+        if export_format == "parquet":
+            if output_path == "-":
+                print("Parquet cannot be written to stdout")
+                sys.exit(1)
+            try:
+                count = write_parquet(rows, output_path)
+            except ValueError as e:
+                print(e)
+                sys.exit(1)
+            print(f"Exported {count} transactions to {output_path}", file=sys.stderr)
+            return
+
+        chunks = iter_ndjson(rows) if export_format == "ndjson" else (chunk.encode() for chunk in iter_csv(rows))
+        output = sys.stdout.buffer if output_path == "-" else open(output_path, "wb")
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
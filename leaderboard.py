@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Pair rankings served by /leaderboard/{metric}: trade volume, transaction
+count and price change over the last 1h, 24h and 7d, and TVL.
+
+Each pair has one pair_window_stats row per window, computed from its
+pair_hourly_stats and indexed per metric, so a ranking is a top-k index
+read. The syncer recomputes a pair's rows with each committed chunk (and
+after reorg rollbacks); as windows slide, rows of pairs that traded within
+the longest window are refreshed once per hour by the worker that syncs
+them. Windows are aligned to whole hours, like those of
+/pair/{pair_launcher_id}/analytics (1h is the current hour so far). To fill
+them for an existing database, run:
+```
+python leaderboard.py rebuild
+```
+"""
+
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Optional
+from dotenv import load_dotenv
+import time
+import sys
+
+import analytics
+import models
+
+# window name -> hours
+LEADERBOARD_WINDOWS = {"1h": 1, "24h": 24, "7d": 7 * 24}
+
+
+def compute_window_stats(db: Session, pair: models.Pair, now: int) -> Dict[str, dict]:
+    # pending hourly stats changes must be flushed
+    current_hour = analytics.hour_of(now)
+    first_hour = current_hour - max(LEADERBOARD_WINDOWS.values()) * analytics.HOUR
+
+    hourly_stats = (
+        db.query(
+            models.PairHourlyStats.hour,
+            models.PairHourlyStats.transaction_count,
+            models.PairHourlyStats.trade_volume,
+            models.PairHourlyStats.xch_reserve,
+            models.PairHourlyStats.token_reserve,
+        )
+        .filter(models.PairHourlyStats.pair_launcher_id == pair.launcher_id)
+        .filter(models.PairHourlyStats.hour > first_hour)
+        .order_by(models.PairHourlyStats.hour)
+        .all()
+    )
+    # reserves going into the longest window, for its opening price
+    previous_stats = (
+        db.query(models.PairHourlyStats.xch_reserve, models.PairHourlyStats.token_reserve)
+        .filter(models.PairHourlyStats.pair_launcher_id == pair.launcher_id)
+        .filter(models.PairHourlyStats.hour <= first_hour)
+        .order_by(models.PairHourlyStats.hour.desc())
+        .first()
+    )
+    current_price = analytics.spot_price(int(pair.xch_reserve or 0), int(pair.token_reserve or 0))
+
+    windows = {}
+    for name, hours in LEADERBOARD_WINDOWS.items():
+        window_start = current_hour - hours * analytics.HOUR
+        in_window = [stats for stats in hourly_stats if stats.hour > window_start]
+
+        # close of the last hour before the window; None for pairs that had
+        # no liquidity yet (no meaningful change)
+        opening = previous_stats
+        for stats in hourly_stats:
+            if stats.hour > window_start:
+                break
+            opening = stats
+        opening_price = analytics.spot_price(opening.xch_reserve, opening.token_reserve) if opening is not None else None
+
+        price_change = None
+        if opening_price and current_price:
+            price_change = current_price / opening_price - 1
+
+        windows[name] = {
+            "transaction_count": sum(stats.transaction_count for stats in in_window),
+            "trade_volume": sum(stats.trade_volume for stats in in_window),
+            "price_change": price_change,
+        }
+    return windows
+
+
+def update_pair(db: Session, pair: models.Pair, now: Optional[int] = None):
+    # recomputes the pair's rows; committed by the caller
+    now = int(time.time()) if now is None else now
+    db.flush()
+    windows = compute_window_stats(db, pair, now)
+
+    rows = {
+        row.period: row
+        for row in db.query(models.PairWindowStats).filter(models.PairWindowStats.pair_launcher_id == pair.launcher_id)
+    }
+    for name, values in windows.items():
+        row = rows.get(name)
+        if row is None:
+            row = models.PairWindowStats(pair_launcher_id=pair.launcher_id, period=name)
+            db.add(row)
+        row.hour = analytics.hour_of(now)
+        row.transaction_count = values["transaction_count"]
+        row.trade_volume = values["trade_volume"]
+        row.price_change = values["price_change"]
+
+
+def refresh_stale(db: Session, now: Optional[int] = None, owns_pair: Optional[Callable[[str], bool]] = None) -> int:
+    # recomputes pairs whose rows are from an earlier hour; without a
+    # transaction in the longest window, a pair's rows no longer change.
+    # Sync workers pass their owns_pair, so a pair's rows are only written by
+    # the worker that syncs it. One commit per pair. Returns the number of
+    # pairs refreshed.
+    now = int(time.time()) if now is None else now
+    longest_window = max(LEADERBOARD_WINDOWS, key=LEADERBOARD_WINDOWS.get)
+    stale_pairs = (
+        db.query(models.Pair.launcher_id, models.Pair.xch_reserve, models.Pair.token_reserve)
+        .join(models.PairWindowStats, models.PairWindowStats.pair_launcher_id == models.Pair.launcher_id)
+        .filter(models.PairWindowStats.period == longest_window)
+        .filter(models.PairWindowStats.hour < analytics.hour_of(now))
+        .filter(models.PairWindowStats.transaction_count > 0)
+        .all()
+    )
+    if owns_pair is not None:
+        stale_pairs = [pair for pair in stale_pairs if owns_pair(pair.launcher_id)]
+    for pair in stale_pairs:
+        update_pair(db, pair, now)
+        db.commit()
+    return len(stale_pairs)
+
+
+def rebuild(db: Session, now: Optional[int] = None):
+    now = int(time.time()) if now is None else now
+    # column rows: only launcher_id and reserves are needed
+    pairs = db.query(models.Pair.launcher_id, models.Pair.xch_reserve, models.Pair.token_reserve).all()
+    for pair in pairs:
+        update_pair(db, pair, now)
+        db.commit()
+    return len(pairs)
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] not in ["rebuild"]:
+        print(__doc__)
+        sys.exit(1)
+
+    load_dotenv()
+    import database
+    database.init_db()
+    db = database.SessionLocal()
+
+    start = time.perf_counter()
+    pairs = rebuild(db)
+    print(f"Rebuilt leaderboard stats of {pairs} pairs in {time.perf_counter() - start:.1f}s")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from dotenv import load_dotenv
 
-import api, database, models, sync, usd_price_sync
+import api, database, metrics, models, shards, stream
 import asyncio
 import time
 import os
@@ -10,69 +11,116 @@ import os
 if os.environ.get("COINSET_URL") is None:
     load_dotenv()
 
+# run the sync task in this process; disable for API-only workers (sync then
+# runs in `python worker.py` processes, which serve their own sync metrics on
+# WORKER_METRICS_PORT; this process' /metrics only has API metrics then)
+SYNC_IN_API = os.environ.get("SYNC_IN_API", "true").lower() in ["1", "true", "yes"]
+
 app = FastAPI(title="TibetSwap Analytics API", description="Analytics for TibetSwap v2 & v2r", version="2.0.0")
 stop_event = asyncio.Event()
 
-# Create database tables
-database.init_db()
+# Tables, router rows and snapshot bootstrapping are set up by migrate.py,
+# not on import
 
 # Include the API router
 app.include_router(api.app)
 
-shared_sess: Session = database.SessionLocal()
-def check_if_height_exists(height: int) -> bool:
-    return shared_sess.query(models.HeightToTimestamp).filter(models.HeightToTimestamp.height == height).first() is not None
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+
+    # label by route template (e.g. /pair/{pair_launcher_id}), not by raw path
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    metrics.HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        endpoint=endpoint,
+        status=response.status_code
+    )
+    return response
 
 last_price_sync_time = 0
 
+# this process' share of the sync work (see shards.py); kept across task retries
+sync_leases = shards.ShardLeases()
+
 # sync task
 async def router_and_pairs_sync_task():
+    # chia / aiohttp / requests are only loaded by processes that sync
+    import leaderboard, reorg, scheduler, sync, usd_price_sync
+
     sync.ensure_client()
 
     db: Session = database.SessionLocal()
+    sync_scheduler = scheduler.SyncScheduler()
+    sync_scheduler.load_activity(db)
+    synced_height = None
     while True:
+        if synced_height is not None:
+            # immediately while catching up, backing off while the chain is idle
+            await sync_scheduler.wait_for_new_blocks(sync.get_confirmed_height, synced_height, lambda: sync_leases.keep_alive(db))
+        sync_leases.keep_alive(db)
+        cycle_start = time.perf_counter()
+
+        # undo anything a reorg invalidated, then only index confirmed spends
+        if sync_leases.owns_router:
+            fork_height = await reorg.handle_reorg(db)
+            if fork_height is not None:
+                stream.record_rollback(db, fork_height)
+        max_height = await sync.get_confirmed_height()
+        # responses up to max_height are reused within this cycle
+        sync.client.start_cycle(max_height)
+        if synced_height is not None:
+            metrics.SYNC_LAG_BLOCKS.set(max_height + sync.CONFIRMATION_DEPTH - synced_height)
+
         for rcat in [False, True]:
-            current_router = await api.get_router(rcat, db)
-            new_router, new_pairs = await sync.sync_router(current_router)
-            if new_router is not None:
-                db.commit()
-                db.refresh(new_router)
-            
-            for new_pair in new_pairs:
-                db.add(new_pair)
-                db.commit()
+            if sync_leases.owns_router:
+                current_router = await api.get_router(rcat, db)
+                new_router, new_pairs = await sync.sync_router(current_router, max_height)
+                if new_router is not None:
+                    with metrics.DB_COMMIT_SECONDS.time(kind="router"):
+                        db.commit()
+                    db.refresh(new_router)
+
+                for new_pair in new_pairs:
+                    db.add(new_pair)
+                    db.commit()
 
             all_current_pairs = await api._get_pairs(db, wrap=False)
-            for current_pair in all_current_pairs:
-                new_pair, new_transactions, new_heights = await sync.sync_pair(current_pair)
-                if new_pair is not None:
-                    # Add all new heights first (they have primary key constraints)
-                    # Track which heights we've added in this batch to avoid duplicates
-                    added_heights = set()
-                    for new_height in new_heights:
-                        if new_height.height not in added_heights and not check_if_height_exists(new_height.height):
-                            db.add(new_height)
-                            added_heights.add(new_height.height)
-                    
-                    # Add all transactions
-                    for new_tx in new_transactions:
-                        db.add(new_tx)
-                    
-                    # Update USD volumes for all transactions
-                    for new_tx in new_transactions:
-                        # Update USD volume if price is available
-                        while True:
-                            try:
-                                usd_price_sync.update_transaction_usd_volume(db, new_tx)
-                                break
-                            except Exception as e:
-                                print(f"Error updating USD volume for transaction: {e}")
-
-                            time.sleep(30)
-                    
-                    # Commit everything together: pair updates, transactions, heights, and USD volumes
-                    db.commit()
-                    db.refresh(new_pair)
+            owned_pairs = [pair for pair in all_current_pairs if sync_leases.owns_pair(pair.launcher_id)]
+            # dormant pairs are only polled every scheduler.DORMANT_PAIR_INTERVAL
+            for current_pair in sync_scheduler.pairs_due(owned_pairs):
+                sync_scheduler.record_checked(current_pair.launcher_id)
+                try:
+                    # each chunk is committed together with the pair checkpoint
+                    # (current_coin_id, last_tx_index, reserves), so a crash only
+                    # repeats the chunk that was in flight
+                    async for new_pair, new_transactions, new_heights in sync.sync_pair(current_pair, max_height):
+                        # serialized before the commit expires the instances
+                        transactions = [api.transaction_to_json(tx) for tx in new_transactions]
+                        sync.commit_pair_chunk(db, new_pair, new_transactions, new_heights)
+                        stream.record_pair_chunk(db, api.pair_to_json(new_pair), transactions)
+                        sync_scheduler.record_activity(new_pair.launcher_id, transactions[-1]["timestamp"])
+
+                        sync_leases.keep_alive(db)
+                        if not sync_leases.owns_pair(new_pair.launcher_id):
+                            # rebalanced to another worker; it continues from this checkpoint
+                            break
+                except StaleDataError:
+                    # another process (rollback, price sync, previous shard
+                    # owner) updated the pair meanwhile; redo from its state
+                    db.rollback()
+                    print(f"Pair {current_pair.launcher_id} changed during sync; retrying next cycle")
+
+        # leaderboard windows of pairs that did not trade this hour slide too
+        await asyncio.to_thread(leaderboard.refresh_stale, db, None, sync_leases.owns_pair)
+        if sync_leases.owns_router:
+            stream.prune_events(db)
+
+        synced_height = max_height
+        metrics.SYNC_CYCLE_SECONDS.observe(time.perf_counter() - cycle_start)
         
         global last_price_sync_time
         current_time = int(time.time())
@@ -81,10 +129,11 @@ async def router_and_pairs_sync_task():
         max_synced = usd_price_sync.get_max_synced_timestamp(db)
         next_sync_time = max_synced + 3600 + 900  # Next hour + 15 min buffer
         
-        if current_time >= next_sync_time and current_time - last_price_sync_time >= 300:
+        if sync_leases.owns_router and current_time >= next_sync_time and current_time - last_price_sync_time >= 300:
             print(f"{current_time} Starting USD price sync...")
             try:
-                new_max_synced = usd_price_sync.sync_prices(db)
+                # blocking HTTP + SQLite work; keep the API responsive meanwhile
+                new_max_synced = await asyncio.to_thread(usd_price_sync.sync_prices, db)
                 if new_max_synced > 0:
                     last_price_sync_time = current_time
                     print(f"USD price sync completed; synced up to {new_max_synced}")
@@ -93,8 +142,6 @@ async def router_and_pairs_sync_task():
             except Exception as e:
                 print(f"Error syncing USD prices: {e}")
 
-        await asyncio.sleep(60)
-
 async def router_and_pairs_sync_task_retry():
     while not stop_event.is_set():
         try:
@@ -104,7 +151,7 @@ async def router_and_pairs_sync_task_retry():
             for i in range(120):
                 if stop_event.is_set():
                     break
-                time.sleep(0.5)
+                await asyncio.sleep(0.5)
 
 
 def handle_task_result(task):
@@ -114,10 +161,24 @@ def handle_task_result(task):
 
 @app.on_event("startup")
 async def startup_event():
+    # /stream events of every sync worker, including this process' own
+    asyncio.create_task(stream.relay_events(stop_event))
+
+    if not SYNC_IN_API:
+        print("SYNC_IN_API=false: /metrics has no sync metrics; scrape the workers' WORKER_METRICS_PORT")
+        return
     task = asyncio.create_task(router_and_pairs_sync_task_retry())
     task.add_done_callback(handle_task_result)
 
 
+def release_sync_leases():
+    # lets other workers take over right away instead of after the lease expires
+    db = database.SessionLocal()
+    sync_leases.release_all(db)
+    db.close()
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
     stop_event.set()
+    release_sync_leases()
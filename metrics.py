@@ -0,0 +1,187 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from typing import Dict, Tuple
+import threading
+import time
+
+# Minimal Prometheus-style metrics (text exposition format 0.0.4), so the
+# sync task and the API can be instrumented without extra dependencies.
+# Values are per process: with several sync workers (see shards.py), each
+# one's sync metrics only cover the router / shards it holds, so every sync
+# process has to be scraped.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+registry = []
+lock = threading.Lock()
+
+
+def escape_label_value(value: str) -> str:
+    # as the text format requires: backslash, double quote and line feed
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: Dict[Tuple[str, ...], object] = {}
+        registry.append(self)
+
+    def key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for label_values, value in sorted(self.values.items()):
+            lines += self.render_value(label_values, value)
+        return lines
+
+    def render_value(self, label_values: Tuple[str, ...], value) -> list:
+        return [f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        with lock:
+            self.values[self.key(labels)] = value
+
+    def remove(self, **labels):
+        with lock:
+            self.values.pop(self.key(labels), None)
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with lock:
+            state = self.values.get(key)
+            if state is None:
+                # [per-bucket counts..., sum, count]
+                state = [0] * len(self.buckets) + [0.0, 0]
+                self.values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render_value(self, label_values: Tuple[str, ...], state) -> list:
+        lines = []
+        for i, bound in enumerate(self.buckets):
+            le = format_labels(self.label_names, label_values, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{le} {state[i]}")
+        le = format_labels(self.label_names, label_values, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{le} {state[-1]}")
+        labels = format_labels(self.label_names, label_values)
+        lines.append(f"{self.name}_sum{labels} {format_value(state[-2])}")
+        lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+def render() -> str:
+    with lock:
+        lines = []
+        for metric in registry:
+            lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scraped every few seconds; not worth a log line each time
+        pass
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    # /metrics for processes without the API (worker.py), on a daemon thread
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+RPC_REQUEST_SECONDS = Histogram(
+    "tibet_rpc_request_seconds", "Full node RPC latency by method", ("method",)
+)
+RPC_ERRORS = Counter(
+    "tibet_rpc_errors_total", "Failed full node RPC requests by method", ("method",)
+)
+RPC_DEDUPLICATED = Counter(
+    "tibet_rpc_deduplicated_total", "Full node RPC requests answered from the cache or by an identical in-flight request", ("method", "kind")
+)
+SYNC_STAGE_SECONDS = Histogram(
+    "tibet_sync_stage_seconds", "Time spent per pair sync stage", ("stage",)
+)
+SYNC_CYCLE_SECONDS = Histogram(
+    "tibet_sync_cycle_seconds", "Duration of a full router + pairs sync cycle",
+    buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+)
+DB_COMMIT_SECONDS = Histogram(
+    "tibet_db_commit_seconds", "SQLite commit duration by kind", ("kind",)
+)
+SYNCED_SPENDS = Counter(
+    "tibet_synced_spends_total", "Pair spends indexed"
+)
+SYNC_LAG_BLOCKS = Gauge(
+    "tibet_sync_lag_blocks", "Blocks between the chain peak and the height the last completed sync cycle covered"
+)
+PAIR_BACKLOG_BLOCKS = Gauge(
+    "tibet_pair_backlog_blocks", "Blocks between the confirmed height and the pair spend being synced", ("pair",)
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "tibet_http_request_seconds", "API request latency by endpoint", ("method", "endpoint", "status")
+)
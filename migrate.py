@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations. Prepares the database before the API or sync
+workers start: loads the BOOTSTRAP_SNAPSHOT on fresh deployments (see
+snapshot.py), applies pending migrations and creates the router rows. The
+API process does not do this on import, so run it once per deployment,
+before any worker (start.sh does).
+
+```
+python migrate.py           # apply pending migrations
+python migrate.py status    # list applied and pending migrations
+```
+
+Applied versions are recorded in schema_migrations. A fresh database gets
+the latest schema from the models directly and all versions are marked as
+applied; an existing one (including databases from before this runner,
+which have no schema_migrations yet) runs every pending migration. Steps
+skip what already exists, so databases migrated by hand are fine too.
+
+Migrations run while the API and sync workers keep going: new columns are
+added without a default that needs a table rewrite, and backfills of large
+tables commit every MIGRATION_BATCH_SIZE rows, so other writers only ever
+wait for one batch. Building an index on a large table still holds the
+write lock until it is done (readers are not blocked). Every step prints
+its duration.
+
+To change the schema, change the models and append a migration to
+MIGRATIONS; never edit or reorder applied ones.
+"""
+
+from contextlib import contextmanager
+from sqlalchemy import inspect, insert, select, text
+from sqlalchemy.engine import Engine
+from dotenv import load_dotenv
+import time
+import sys
+import os
+
+import models
+
+MIGRATION_BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", "10000"))
+
+
+@contextmanager
+def timed_step(description: str):
+    start = time.perf_counter()
+    yield
+    print(f"  {description}: {time.perf_counter() - start:.2f}s")
+
+
+def has_column(engine: Engine, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(engine).get_columns(table))
+
+
+def add_column(engine: Engine, table: str, column: str, definition: str) -> bool:
+    # constant defaults (or none) only: SQLite then only changes the schema,
+    # existing rows are filled with update_in_batches. False if it existed.
+    if has_column(engine, table, column):
+        return False
+    with timed_step(f"add {table}.{column}"), engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+    return True
+
+
+def drop_column(engine: Engine, table: str, column: str):
+    if not has_column(engine, table, column):
+        return
+    with timed_step(f"drop {table}.{column}"), engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+
+
+def create_index(engine: Engine, name: str):
+    # as defined on the models
+    import database
+
+    index = next(
+        index
+        for table in database.Base.metadata.tables.values()
+        for index in table.indexes
+        if index.name == name
+    )
+    if any(existing["name"] == name for existing in inspect(engine).get_indexes(index.table.name)):
+        return
+    with timed_step(f"create index {name}"):
+        index.create(engine)
+
+
+def create_table(engine: Engine, table):
+    if inspect(engine).has_table(table.name):
+        return
+    with timed_step(f"create table {table.name}"):
+        table.create(engine)
+
+
+def update_in_batches(engine: Engine, table: str, assignments: str, where: str = "1"):
+    # one short write transaction per rowid range; rows inserted meanwhile are
+    # written by the current code and need no backfill
+    with engine.connect() as conn:
+        max_rowid = conn.execute(text(f"SELECT MAX(rowid) FROM {table}")).scalar() or 0
+
+    with timed_step(f"update {table} ({max_rowid} rows)"):
+        for first_rowid in range(1, max_rowid + 1, MIGRATION_BATCH_SIZE):
+            with engine.begin() as conn:
+                conn.execute(
+                    text(f"UPDATE {table} SET {assignments} WHERE rowid >= :first AND rowid < :last AND ({where})"),
+                    {"first": first_rowid, "last": first_rowid + MIGRATION_BATCH_SIZE},
+                )
+
+
+def migrate_v2_columns(engine: Engine):
+    add_column(engine, "pairs", "hidden_puzzle_hash", "VARCHAR(64)")
+    add_column(engine, "pairs", "inverse_fee", "BIGINT")
+    update_in_batches(engine, "pairs", "hidden_puzzle_hash = ''", "hidden_puzzle_hash IS NULL")
+    update_in_batches(engine, "pairs", "inverse_fee = 993", "inverse_fee IS NULL")
+
+    drop_column(engine, "router", "network")
+    add_column(engine, "router", "rcat", "BOOLEAN")
+    update_in_batches(engine, "router", "rcat = 0", "rcat IS NULL")
+
+
+def migrate_usd_prices(engine: Engine):
+    add_column(engine, "pairs", "trade_volume_usd", "VARCHAR DEFAULT '0'")
+    update_in_batches(engine, "pairs", "trade_volume_usd = '0'", "trade_volume_usd IS NULL")
+    create_table(engine, models.AverageUsdPrice.__table__)
+    create_index(engine, "idx_average_usd_price_to_timestamp")
+
+
+def migrate_reorg_tracking(engine: Engine):
+    # NULL for heights indexed before this change
+    add_column(engine, "height_to_timestamp", "header_hash", "VARCHAR(64)")
+    create_index(engine, "idx_transactions_height")
+
+
+def migrate_pair_indexes(engine: Engine):
+    create_index(engine, "idx_pairs_asset_id")
+    create_index(engine, "idx_pairs_xch_reserve")
+
+
+def migrate_pair_tx_index(engine: Engine):
+    create_index(engine, "idx_transactions_pair_tx_index")
+
+
+def migrate_transaction_timestamps(engine: Engine):
+    add_column(engine, "transactions", "timestamp", "BIGINT")
+    update_in_batches(
+        engine,
+        "transactions",
+        "timestamp = (SELECT height_to_timestamp.timestamp FROM height_to_timestamp WHERE height_to_timestamp.height = transactions.height)",
+        "timestamp IS NULL",
+    )
+    create_index(engine, "idx_transactions_timestamp")
+
+
+def migrate_sync_shards(engine: Engine):
+    add_column(engine, "pairs", "sync_version", "INTEGER NOT NULL DEFAULT 0")
+    create_table(engine, models.SyncLease.__table__)
+
+
+def migrate_pair_state_indexes(engine: Engine):
+    create_index(engine, "idx_transactions_pair_height")
+    create_index(engine, "idx_height_to_timestamp_timestamp")
+
+
+def rebuild_hourly_stats(engine: Engine):
+    # and the leaderboard windows derived from them (pair_window_stats is
+    # created up front by run_migrations' create_all)
+    import analytics, database, leaderboard
+
+    db = database.SessionLocal(bind=engine)
+    # column rows instead of Pair instances: later migrations may add pair
+    # columns this schema version does not have yet
+    pairs = db.query(models.Pair.launcher_id, models.Pair.inverse_fee).all()
+    with timed_step(f"rebuild pair_hourly_stats ({len(pairs)} pairs)"):
+        for pair in pairs:
+            # one transaction per pair
+            analytics.rebuild_hourly_stats(db, pair)
+            db.commit()
+    with timed_step("rebuild pair_window_stats"):
+        leaderboard.rebuild(db)
+    db.close()
+
+
+def migrate_hourly_stats(engine: Engine):
+    table = models.PairHourlyStats.__table__
+    create_table(engine, table)
+
+    # the rebuild writes every current model column; while a later migration
+    # still has to add some (liquidity flows, 11), that one rebuilds instead
+    if any(not has_column(engine, table.name, column.name) for column in table.columns):
+        return
+
+    with engine.connect() as conn:
+        # already filled by `python analytics.py rebuild`
+        if conn.execute(select(models.PairHourlyStats.hour).limit(1)).first() is not None:
+            return
+    rebuild_hourly_stats(engine)
+
+
+def migrate_leaderboard(engine: Engine):
+    import database, leaderboard
+
+    create_table(engine, models.PairWindowStats.__table__)
+
+    db = database.SessionLocal(bind=engine)
+    if db.query(models.PairWindowStats).first() is None:
+        with timed_step("rebuild pair_window_stats"):
+            leaderboard.rebuild(db)
+    db.close()
+
+
+def migrate_liquidity_flows(engine: Engine):
+    added = [
+        add_column(engine, "pair_hourly_stats", column, "BIGINT DEFAULT 0")
+        for column in ["liquidity_added", "liquidity_removed", "liquidity_xch_flow", "liquidity_token_flow"]
+    ]
+    # rows written before this change have zeros there
+    if any(added):
+        rebuild_hourly_stats(engine)
+
+
+def migrate_stream_events(engine: Engine):
+    create_table(engine, models.StreamEvent.__table__)
+
+
+# (version, description, migration); append only
+MIGRATIONS = [
+    (1, "v1 to v2: hidden puzzle hash, inverse fee and rCAT router columns", migrate_v2_columns),
+    (2, "USD trade volume and average_usd_price", migrate_usd_prices),
+    (3, "block header hashes for reorg handling", migrate_reorg_tracking),
+    (4, "pairs indexes for /pairs", migrate_pair_indexes),
+    (5, "transactions index by pair and pair_tx_index", migrate_pair_tx_index),
+    (6, "block timestamps on transactions", migrate_transaction_timestamps),
+    (7, "sharded sync: pairs.sync_version and sync_leases", migrate_sync_shards),
+    (8, "indexes for /pair/{pair_launcher_id}/state", migrate_pair_state_indexes),
+    (9, "pair_hourly_stats", migrate_hourly_stats),
+    (10, "pair_window_stats for /leaderboard", migrate_leaderboard),
+    (11, "liquidity flows in pair_hourly_stats", migrate_liquidity_flows),
+    (12, "stream_events for /stream across processes", migrate_stream_events),
+]
+
+
+def applied_versions(engine: Engine) -> set:
+    if not inspect(engine).has_table(models.SchemaMigration.__tablename__):
+        return set()
+    with engine.connect() as conn:
+        return set(version for (version,) in conn.execute(select(models.SchemaMigration.version)))
+
+
+def record_migration(engine: Engine, version: int, name: str, duration_ms: int):
+    with engine.begin() as conn:
+        conn.execute(insert(models.SchemaMigration).values(
+            version=version,
+            name=name,
+            applied_at=int(time.time()),
+            duration_ms=duration_ms,
+        ))
+
+
+def run_migrations(engine: Engine) -> int:
+    # returns the number of migrations applied
+    import database
+
+    fresh = not inspect(engine).has_table(models.Pair.__tablename__)
+    applied = applied_versions(engine)
+    pending = [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+    # only creates missing tables (with their indexes), never alters existing ones
+    database.Base.metadata.create_all(bind=engine)
+
+    if fresh:
+        # create_all just built the latest schema
+        for version, name, _ in pending:
+            record_migration(engine, version, name, 0)
+        return 0
+
+    for version, name, migration in pending:
+        print(f"Migration {version}: {name}")
+        start = time.perf_counter()
+        migration(engine)
+        duration = time.perf_counter() - start
+        record_migration(engine, version, name, int(duration * 1000))
+        print(f"Migration {version} done in {duration:.2f}s")
+    return len(pending)
+
+
+def print_status(engine: Engine):
+    applied = {}
+    if inspect(engine).has_table(models.SchemaMigration.__tablename__):
+        with engine.connect() as conn:
+            applied = {row.version: row for row in conn.execute(select(models.SchemaMigration))}
+
+    for version, name, _ in MIGRATIONS:
+        row = applied.get(version)
+        if row is None:
+            print(f"{version:>3}  pending                            {name}")
+        else:
+            applied_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(row.applied_at))
+            print(f"{version:>3}  applied {applied_at} ({row.duration_ms / 1000:>6.1f}s)  {name}")
+
+
+def main():
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] != "status"):
+        print(__doc__)
+        sys.exit(1)
+
+    if os.environ.get("COINSET_URL") is None:
+        load_dotenv()
+    import database
+
+    if len(sys.argv) == 2:
+        print_status(database.engine)
+        return
+
+    import snapshot
+    snapshot.bootstrap_if_needed()
+
+    start = time.perf_counter()
+    # runs run_migrations
+    database.init_db()
+    print(f"Database is up to date ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
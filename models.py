@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, BigInteger, Boolean, JSON
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, Float, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 import database
 
@@ -26,6 +26,15 @@ class Pair(database.Base):
     trade_volume = Column(String, default="0")
     trade_volume_usd = Column(String, default="0")
     last_tx_index = Column(BigInteger, default=-1)
+    # bumped on every update; a sync worker committing a pair that another
+    # process changed meanwhile (e.g. a reorg rollback) fails with StaleDataError
+    sync_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index('idx_pairs_asset_id', 'asset_id'),
+        Index('idx_pairs_xch_reserve', 'xch_reserve'),
+    )
+    __mapper_args__ = {"version_id_col": sync_version}
 
 class Transaction(database.Base):
     __tablename__ = 'transactions'
@@ -37,6 +46,15 @@ class Transaction(database.Base):
     new_state = Column(JSON)
     height = Column(BigInteger)
     pair_tx_index = Column(BigInteger)
+    # block timestamp (copied from height_to_timestamp at sync time)
+    timestamp = Column(BigInteger)
+
+    __table_args__ = (
+        Index('idx_transactions_height', 'height'),
+        Index('idx_transactions_timestamp', 'timestamp'),
+        Index('idx_transactions_pair_tx_index', 'pair_launcher_id', 'pair_tx_index'),
+        Index('idx_transactions_pair_height', 'pair_launcher_id', 'height', 'pair_tx_index'),
+    )
 
 
 class HeightToTimestamp(database.Base):
@@ -44,6 +62,77 @@ class HeightToTimestamp(database.Base):
 
     height = Column(BigInteger, primary_key=True, unique=True)
     timestamp = Column(BigInteger)
+    header_hash = Column(String(64))
+
+    __table_args__ = (
+        Index('idx_height_to_timestamp_timestamp', 'timestamp'),
+    )
+
+class SyncLease(database.Base):
+    # sync worker heartbeats ("worker:<id>") and work leases ("router",
+    # "shard:<n>"), see shards.py
+    __tablename__ = 'sync_leases'
+
+    name = Column(String, primary_key=True)
+    owner = Column(String)
+    expires_at = Column(BigInteger)
+
+class StreamEvent(database.Base):
+    # /stream events, written by the sync worker that produced them and relayed
+    # to subscribers by every API process; pruned after a while, see stream.py
+    __tablename__ = 'stream_events'
+    # ids are never reused, so relays can follow the table by id
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(BigInteger)
+    event = Column(String)
+    pair_launcher_id = Column(String(64))
+    # serialized JSON payload
+    data = Column(String)
+
+class PairHourlyStats(database.Base):
+    # per-pair aggregates for one hour (hour = timestamp rounded down to a
+    # multiple of 3600, i.e. aligned with AverageUsdPrice.from_timestamp),
+    # maintained by the syncer; reserves are the ones at the end of the hour
+    __tablename__ = 'pair_hourly_stats'
+
+    pair_launcher_id = Column(String(64), primary_key=True)
+    hour = Column(BigInteger, primary_key=True)
+    transaction_count = Column(BigInteger, default=0)
+    swap_count = Column(BigInteger, default=0)
+    trade_volume = Column(BigInteger, default=0)
+    fee_revenue = Column(BigInteger, default=0)
+    xch_reserve = Column(BigInteger)
+    token_reserve = Column(BigInteger)
+    liquidity = Column(BigInteger)
+    # liquidity events: liquidity tokens minted / burned, and the XCH and
+    # tokens deposited (positive) or withdrawn (negative) by providers
+    liquidity_added = Column(BigInteger, default=0)
+    liquidity_removed = Column(BigInteger, default=0)
+    liquidity_xch_flow = Column(BigInteger, default=0)
+    liquidity_token_flow = Column(BigInteger, default=0)
+
+
+class PairWindowStats(database.Base):
+    # per-pair totals over the last 1h / 24h / 7d (period), as of hour; kept
+    # up to date by the syncer and ranked by /leaderboard, see leaderboard.py
+    __tablename__ = 'pair_window_stats'
+
+    pair_launcher_id = Column(String(64), primary_key=True)
+    period = Column(String, primary_key=True)
+    hour = Column(BigInteger)
+    transaction_count = Column(BigInteger)
+    trade_volume = Column(BigInteger)
+    # relative spot price change since the window start; None without a price then
+    price_change = Column(Float)
+
+    __table_args__ = (
+        Index('idx_pair_window_stats_trade_volume', 'period', 'trade_volume', 'pair_launcher_id'),
+        Index('idx_pair_window_stats_transaction_count', 'period', 'transaction_count', 'pair_launcher_id'),
+        Index('idx_pair_window_stats_price_change', 'period', 'price_change', 'pair_launcher_id'),
+    )
+
 
 class AverageUsdPrice(database.Base):
     __tablename__ = 'average_usd_price'
@@ -51,3 +140,17 @@ class AverageUsdPrice(database.Base):
     from_timestamp = Column(BigInteger, primary_key=True, unique=True)
     to_timestamp = Column(BigInteger)
     price_cents = Column(BigInteger)
+
+    __table_args__ = (
+        Index('idx_average_usd_price_to_timestamp', 'to_timestamp'),
+    )
+
+
+class SchemaMigration(database.Base):
+    # applied schema migrations, see migrate.py
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String)
+    applied_at = Column(BigInteger)
+    duration_ms = Column(BigInteger)
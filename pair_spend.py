@@ -0,0 +1,203 @@
+from chia.wallet.util.curry_and_treehash import curry_and_treehash, calculate_hash_of_quoted_mod_hash
+from chia.types.blockchain_format.program import DEFAULT_FLAGS, INFINITE_COST
+from chia.consensus.condition_tools import conditions_dict_for_solution
+from chia.types.condition_opcodes import ConditionOpcode
+from chia.types.blockchain_format.serialized_program import SerializedProgram
+from chia.types.blockchain_format.program import Program
+from chia_rs import Coin, run_chia_program, serialized_length, tree_hash
+from chia_rs.sized_bytes import bytes32
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Decoding of pair singleton spends (spend -> old state, new state, next coin id).
+#
+# The puzzle reveal and solution are navigated in their serialized form: the
+# curried arguments and the new-state puzzle are sliced out of the blobs and
+# hashed/run in Rust, so the large pair puzzle is never converted to a Python
+# tree and re-serialized. Both puzzle layers curry in their own module hash
+# (SINGLETON_STRUCT's first element and the inner puzzle's first argument), so
+# module templates are identified by tree hash for free. Once a template has
+# been verified against a full puzzle run, the next pair coin is derived by
+# re-currying the new state instead of running the whole puzzle again.
+
+DUMMY_SINGLETON_STRUCT = (b"\x00" * 32, (b"\x00" * 32, b"\x00" * 32))
+DUMMY_COIN_ID = b"\x00" * 32
+
+# serialized (DUMMY_SINGLETON_STRUCT DUMMY_COIN_ID) - the end of the new-state puzzle's solution
+NEW_STATE_SOLUTION_TAIL = bytes(Program.to([DUMMY_SINGLETON_STRUCT, DUMMY_COIN_ID]))
+
+# (singleton mod hash, inner mod hash) -> True if re-currying the new state
+# predicts the recreated pair coin, False if a full run is always needed
+template_cache: Dict[Tuple[bytes, bytes], bool] = {}
+
+# quoted mod hashes (calculate_hash_of_quoted_mod_hash) by mod hash
+quoted_mod_hash_cache: Dict[bytes, bytes32] = {}
+
+
+class DecodedPairSpend(NamedTuple):
+    old_state: Program
+    new_state: Program
+    next_coin_id: Optional[bytes32]
+
+
+def node_end(blob: bytes, offset: int) -> int:
+    return offset + serialized_length(blob[offset:])
+
+
+def node_at(blob: bytes, offset: int, path: str) -> int:
+    # same path syntax as Program.at, e.g. "rrf"
+    for step in path:
+        if blob[offset] != 0xff:
+            raise ValueError(f"expected a pair at offset {offset}")
+        offset = offset + 1 if step == "f" else node_end(blob, offset + 1)
+    return offset
+
+
+def uncurried_args(blob: bytes, offset: int) -> List[Tuple[int, int]]:
+    # (a (q . MOD) (c (q . ARG) (c (q . ARG) ... 1))) -> [(start, end)] of each ARG
+    if blob[offset:offset + 5] != b"\xff\x02\xff\xff\x01":
+        raise ValueError(f"no curried puzzle at offset {offset}")
+    env = node_end(blob, offset + 3) + 1
+
+    args = []
+    while blob[env] != 0x01:
+        if blob[env:env + 5] != b"\xff\x04\xff\xff\x01":
+            raise ValueError(f"unexpected curried environment at offset {env}")
+        arg_end = node_end(blob, env + 5)
+        args.append((env + 5, arg_end))
+        env = arg_end + 1 # skip the 0xff that conses the rest of the environment
+    return args
+
+
+def quoted_mod_hash(mod_hash: bytes) -> bytes32:
+    quoted = quoted_mod_hash_cache.get(mod_hash)
+    if quoted is None:
+        quoted = calculate_hash_of_quoted_mod_hash(bytes32(mod_hash))
+        quoted_mod_hash_cache[mod_hash] = quoted
+    return quoted
+
+
+def pair_puzzle_hash(
+    singleton_mod_hash: bytes,
+    singleton_struct_hash: bytes32,
+    inner_mod_hash: bytes,
+    inner_arg_hashes: list,
+) -> bytes32:
+    inner_puzzle_hash = curry_and_treehash(quoted_mod_hash(inner_mod_hash), *inner_arg_hashes)
+    return curry_and_treehash(quoted_mod_hash(singleton_mod_hash), singleton_struct_hash, inner_puzzle_hash)
+
+
+def next_coin_id_from_run(coin: Coin, puzzle_reveal, solution) -> Optional[bytes32]:
+    conditions_dict = conditions_dict_for_solution(puzzle_reveal, solution, INFINITE_COST)
+
+    next_coin_id = None
+    for cwa in conditions_dict.get(ConditionOpcode.CREATE_COIN, []):
+        new_puzzle_hash = cwa.vars[0]
+        new_amount = cwa.vars[1]
+
+        if new_amount == b"\x01": # CREATE_COIN with amount=1 -> pair recreation
+            next_coin_id = Coin(coin.name(), new_puzzle_hash, 1).name()
+    return next_coin_id
+
+
+def atom_32(blob: bytes, start: int, end: int) -> bytes:
+    if end - start != 33 or blob[start] != 0xa0:
+        raise ValueError(f"expected a 32-byte atom at offset {start}")
+    return blob[start + 1:end]
+
+
+def decode_pair_spend_program(coin: Coin, puzzle_reveal, solution) -> DecodedPairSpend:
+    # generic (slower) path for spends that cannot be navigated byte-wise,
+    # e.g. serializations using back references
+    puzzle = Program.from_bytes(bytes(puzzle_reveal))
+    p2_merkle_solution = Program.from_bytes(bytes(solution)).at("rrf")
+
+    old_state = puzzle.uncurry()[1].at("rf").uncurry()[1].at("rrf")
+    new_state_puzzle = p2_merkle_solution.at("f")
+    params = p2_merkle_solution.at("rrf").at("r")
+    new_state = new_state_puzzle.run([old_state, params, DUMMY_SINGLETON_STRUCT, DUMMY_COIN_ID]).at("f")
+
+    return DecodedPairSpend(old_state, new_state, next_coin_id_from_run(coin, puzzle_reveal, solution))
+
+
+def decode_pair_spend(coin: Coin, puzzle_reveal, solution) -> DecodedPairSpend:
+    puzzle_blob = bytes(puzzle_reveal)
+    solution_blob = bytes(solution)
+    try:
+        return decode_pair_spend_blobs(coin, puzzle_reveal, solution, puzzle_blob, solution_blob)
+    except (ValueError, IndexError):
+        return decode_pair_spend_program(coin, puzzle_reveal, solution)
+
+
+def decode_pair_spend_blobs(
+    coin: Coin,
+    puzzle_reveal,
+    solution,
+    puzzle_blob: bytes,
+    solution_blob: bytes,
+) -> DecodedPairSpend:
+    # singleton_top_layer(SINGLETON_STRUCT, INNER_PUZZLE)
+    # INNER_PUZZLE = pair_inner_puzzle(INNER_PUZZLE_HASH, MERKLE_ROOT, STATE)
+    singleton_args = uncurried_args(puzzle_blob, 0)
+    struct_start, struct_end = singleton_args[0]
+    inner_args = uncurried_args(puzzle_blob, singleton_args[1][0])
+    state_start, state_end = inner_args[2]
+    old_state_blob = puzzle_blob[state_start:state_end]
+
+    # for a particular pair, the puzzle run throug p2_merkle_root
+    # returns the new state as the first element!
+    p2_merkle_solution = node_at(solution_blob, 0, "rrf")
+    new_state_puzzle = node_at(solution_blob, p2_merkle_solution, "f") # p2_merkle_tree_modified -> parameters (which is a puzzle)
+    params = node_at(solution_blob, p2_merkle_solution, "rrfr")
+
+    new_state_puzzle_sol = b"\xff" + old_state_blob + b"\xff" + \
+        solution_blob[params:node_end(solution_blob, params)] + NEW_STATE_SOLUTION_TAIL
+    _cost, new_state_puzzle_output = run_chia_program(
+        solution_blob[new_state_puzzle:node_end(solution_blob, new_state_puzzle)],
+        new_state_puzzle_sol,
+        INFINITE_COST,
+        DEFAULT_FLAGS
+    )
+    old_state = Program.from_bytes(old_state_blob)
+    new_state = Program.to(new_state_puzzle_output.pair[0])
+
+    singleton_mod_hash = atom_32(puzzle_blob, struct_start + 1, node_end(puzzle_blob, struct_start + 1))
+    inner_mod_hash = atom_32(puzzle_blob, *inner_args[0])
+    template = (singleton_mod_hash, inner_mod_hash)
+    predictable = template_cache.get(template)
+    if predictable is False:
+        return DecodedPairSpend(old_state, new_state, next_coin_id_from_run(coin, puzzle_reveal, solution))
+
+    singleton_struct_hash = bytes32(tree_hash(puzzle_blob[struct_start:struct_end]))
+    arg_hashes = [bytes32(tree_hash(puzzle_blob[start:end])) for start, end in inner_args]
+    arg_hashes[2] = new_state.get_tree_hash()
+    predicted_puzzle_hash = pair_puzzle_hash(singleton_mod_hash, singleton_struct_hash, inner_mod_hash, arg_hashes)
+    predicted_coin_id = Coin(coin.name(), predicted_puzzle_hash, 1).name()
+
+    if predictable is None:
+        # first spend of this template - check that the curried module hashes
+        # describe the spent puzzle and verify the prediction once
+        arg_hashes[2] = bytes32(tree_hash(old_state_blob))
+        current_puzzle_hash = pair_puzzle_hash(singleton_mod_hash, singleton_struct_hash, inner_mod_hash, arg_hashes)
+
+        next_coin_id = next_coin_id_from_run(coin, puzzle_reveal, solution)
+        template_cache[template] = current_puzzle_hash == coin.puzzle_hash and next_coin_id == predicted_coin_id
+        return DecodedPairSpend(old_state, new_state, next_coin_id)
+
+    return DecodedPairSpend(old_state, new_state, predicted_coin_id)
+
+
+def decode_serialized_pair_spend(
+    parent_coin_info: bytes,
+    puzzle_hash: bytes,
+    amount: int,
+    puzzle_reveal: bytes,
+    solution: bytes,
+) -> Tuple[bytes, bytes, Optional[bytes]]:
+    # process pool entry point - plain bytes in, plain bytes out
+    coin = Coin(bytes32(parent_coin_info), bytes32(puzzle_hash), amount)
+    decoded = decode_pair_spend(coin, SerializedProgram.from_bytes(puzzle_reveal), SerializedProgram.from_bytes(solution))
+    return (
+        bytes(decoded.old_state),
+        bytes(decoded.new_state),
+        bytes(decoded.next_coin_id) if decoded.next_coin_id is not None else None
+    )
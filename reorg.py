@@ -0,0 +1,101 @@
+from sqlalchemy.orm import Session
+from typing import Optional
+import analytics, leaderboard, metrics, models, sync, usd_price_sync
+import os
+
+# max. number of recorded heights checked per cycle when looking for a fork
+# point; deeper reorgs are unwound over several cycles
+REORG_SEARCH_LIMIT = int(os.environ.get("REORG_SEARCH_LIMIT", "100"))
+
+
+async def find_fork_height(db: Session) -> Optional[int]:
+    # Heights are only recorded for blocks with pair spends. If the most recent
+    # recorded block is still part of the chain, so is everything below it;
+    # otherwise walk down until a recorded block matches again.
+    recorded_heights = (
+        db.query(models.HeightToTimestamp)
+        .filter(models.HeightToTimestamp.header_hash != None)
+        .order_by(models.HeightToTimestamp.height.desc())
+        .limit(REORG_SEARCH_LIMIT)
+        .all()
+    )
+
+    lowest_mismatch = None
+    for recorded in recorded_heights:
+        block_record = await sync.client.get_block_record_by_height(recorded.height)
+        if block_record is None:
+            print(f"Could not fetch block record for height {recorded.height}; skipping reorg check")
+            return None
+
+        if block_record.header_hash.hex() == recorded.header_hash:
+            return None if lowest_mismatch is None else recorded.height
+
+        lowest_mismatch = recorded.height
+
+    return None if lowest_mismatch is None else lowest_mismatch - 1
+
+
+def rollback_above(db: Session, fork_height: int):
+    # Undo every transaction above fork_height: pairs are rewound to the first
+    # rolled-back coin (which was created at or below the fork), reserves come
+    # from the last transaction that stays, and volumes are subtracted again.
+    rolled_back = (
+        db.query(models.Transaction)
+        .filter(models.Transaction.height > fork_height)
+        .order_by(models.Transaction.pair_launcher_id, models.Transaction.pair_tx_index)
+        .all()
+    )
+    transactions_by_pair = {}
+    rewound_pairs = []
+    for tx in rolled_back:
+        transactions_by_pair.setdefault(tx.pair_launcher_id, []).append(tx)
+
+    for pair_launcher_id, transactions in transactions_by_pair.items():
+        pair = db.query(models.Pair).filter(models.Pair.launcher_id == pair_launcher_id).first()
+        if pair is None:
+            continue
+
+        first_rolled_back = transactions[0]
+        pair.current_coin_id = first_rolled_back.coin_id
+        pair.last_tx_index = int(first_rolled_back.pair_tx_index) - 1
+
+        for tx in transactions:
+            if tx.operation == "SWAP":
+                pair.trade_volume = int(pair.trade_volume) - abs(tx.state_change["xch"])
+                usd_volume_cents = usd_price_sync.get_transaction_usd_volume_cents(db, tx)
+                pair.trade_volume_usd = str(int(pair.trade_volume_usd or 0) - usd_volume_cents)
+
+        last_kept = (
+            db.query(models.Transaction)
+            .filter(models.Transaction.pair_launcher_id == pair_launcher_id)
+            .filter(models.Transaction.pair_tx_index < first_rolled_back.pair_tx_index)
+            .order_by(models.Transaction.pair_tx_index.desc())
+            .first()
+        )
+        state = last_kept.new_state if last_kept is not None else {"xch": 0, "token": 0, "liquidity": 0}
+        pair.xch_reserve = state["xch"]
+        pair.token_reserve = state["token"]
+        pair.liquidity = state["liquidity"]
+
+        rewound_pairs.append((pair, first_rolled_back.timestamp or 0))
+        print(f"Rolled back {len(transactions)} transactions of pair {pair_launcher_id}")
+
+    db.query(models.Transaction).filter(models.Transaction.height > fork_height).delete()
+    db.query(models.HeightToTimestamp).filter(models.HeightToTimestamp.height > fork_height).delete()
+
+    # hourly aggregates from the first rolled-back transaction's hour on
+    for pair, first_rolled_back_timestamp in rewound_pairs:
+        analytics.rebuild_hourly_stats(db, pair, first_rolled_back_timestamp)
+        leaderboard.update_pair(db, pair)
+
+
+async def handle_reorg(db: Session) -> Optional[int]:
+    fork_height = await find_fork_height(db)
+    if fork_height is None:
+        return None
+
+    print(f"Reorg detected; rolling back everything above height {fork_height}")
+    rollback_above(db, fork_height)
+    with metrics.DB_COMMIT_SECONDS.time(kind="rollback"):
+        db.commit()
+    return fork_height
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Historical resync: rebuilds (or catches up) the database from the router
+launchers, spreading CLVM decoding over all cores.
+
+Pair spends are fetched first - the pair coin chain is followed through
+get_coin_records_by_parent_ids, so no CLVM has to run to find the next coin -
+and the pure decoding step (spend -> old/new state, next coin id) is fanned
+out to a ProcessPoolExecutor. Decoded spends are merged back in chain order
+and committed in chunks, exactly like the regular sync task does. While a
+batch is being decoded, the next one is already being fetched.
+
+Usage:
+```
+python resync.py [workers]
+```
+"""
+
+from chia.types.blockchain_format.program import Program
+from chia_rs.sized_bytes import bytes32
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple
+from dotenv import load_dotenv
+import models, database, pair_spend, sync
+import asyncio
+import sys
+import os
+
+# number of pair spends fetched (and decoded in parallel) at once
+RESYNC_FETCH_BATCH = int(os.environ.get("RESYNC_FETCH_BATCH", "200"))
+
+
+class FetchedSpend(NamedTuple):
+    coin_record: object
+    coin_spend: object
+    next_coin_record: Optional[object]
+
+
+async def fetch_pair_spends(
+    coin_id: bytes32,
+    coin_record,
+    max_spends: int,
+    max_height: Optional[int],
+) -> List[FetchedSpend]:
+    fetched = []
+    while coin_record is not None and sync.is_confirmed_spend(coin_record, max_height) and len(fetched) < max_spends:
+        coin_spend = await sync.client.get_puzzle_and_solution(coin_id, coin_record.spent_block_index)
+
+        # the recreated pair is the only child with amount=1 - if that's ambiguous,
+        # decode this one spend locally to find it
+        children = [
+            c for c in await sync.client.get_coin_records_by_parent_ids([coin_id])
+            if c.coin.amount == 1
+        ]
+        if len(children) != 1:
+            next_coin_id = pair_spend.decode_pair_spend(
+                coin_spend.coin,
+                coin_spend.puzzle_reveal,
+                coin_spend.solution
+            ).next_coin_id
+            children = [c for c in children if c.coin.name() == next_coin_id]
+            if len(children) == 0 and next_coin_id is not None:
+                children = [await sync.client.get_coin_record_by_name(next_coin_id)]
+
+        next_coin_record = children[0] if len(children) > 0 else None
+        fetched.append(FetchedSpend(coin_record, coin_spend, next_coin_record))
+
+        coin_record = next_coin_record
+        coin_id = next_coin_record.coin.name() if next_coin_record is not None else None
+
+    return fetched
+
+
+def decode_in_executor(loop, executor: ProcessPoolExecutor, coin_spend):
+    return loop.run_in_executor(
+        executor,
+        pair_spend.decode_serialized_pair_spend,
+        bytes(coin_spend.coin.parent_coin_info),
+        bytes(coin_spend.coin.puzzle_hash),
+        coin_spend.coin.amount,
+        bytes(coin_spend.puzzle_reveal),
+        bytes(coin_spend.solution),
+    )
+
+
+async def sync_pair_parallel(
+    pair: models.Pair,
+    executor: ProcessPoolExecutor,
+    max_height: Optional[int] = None,
+    chunk_size: int = sync.PAIR_SYNC_CHUNK_SIZE,
+) -> AsyncIterator[Tuple[models.Pair, List[models.Transaction], List[models.HeightToTimestamp]]]:
+    # same contract as sync.sync_pair: yields checkpointed chunks in chain order
+    loop = asyncio.get_running_loop()
+
+    current_pair_coin_id, coin_record = await sync.get_first_unsynced_pair_coin(pair)
+    batch = await fetch_pair_spends(current_pair_coin_id, coin_record, RESYNC_FETCH_BATCH, max_height)
+
+    new_state = None
+    while len(batch) > 0:
+        print(f"Decoding {len(batch)} spends of pair {pair.launcher_id}...")
+        decoding = [decode_in_executor(loop, executor, fetched.coin_spend) for fetched in batch]
+
+        # fetch the next batch and block timestamps while the pool is busy
+        last_coin_record = batch[-1].next_coin_record
+        next_batch_task = asyncio.create_task(fetch_pair_spends(
+            last_coin_record.coin.name() if last_coin_record is not None else None,
+            last_coin_record,
+            RESYNC_FETCH_BATCH,
+            max_height
+        ))
+        try:
+            heights = list({fetched.coin_record.spent_block_index for fetched in batch})
+            height_infos = dict(zip(heights, await asyncio.gather(*[sync.get_height_info(h) for h in heights])))
+
+            new_transactions = []
+            new_heights = []
+            diverged = False
+            for fetched, decoded in zip(batch, decoding):
+                old_state_bytes, new_state_bytes, next_coin_id = await decoded
+                if next_coin_id is None:
+                    raise ValueError(f"Pair coin {current_pair_coin_id.hex()} was spent without being recreated")
+
+                new_state = Program.from_bytes(new_state_bytes)
+                height = fetched.coin_record.spent_block_index
+                tx, new_height = sync.record_pair_spend(
+                    pair,
+                    current_pair_coin_id,
+                    Program.from_bytes(old_state_bytes),
+                    new_state,
+                    height,
+                    *height_infos[height]
+                )
+                new_transactions.append(tx)
+                new_heights.append(new_height)
+
+                current_pair_coin_id = bytes32(next_coin_id)
+
+                if len(new_transactions) >= chunk_size:
+                    sync.checkpoint_pair(pair, new_state, current_pair_coin_id)
+                    yield pair, new_transactions, new_heights
+                    new_transactions = []
+                    new_heights = []
+
+                # CLVM is the source of truth - if the coin chain we fetched
+                # disagrees, drop the rest of the batch and refetch from here
+                if fetched.next_coin_record is None or fetched.next_coin_record.coin.name() != current_pair_coin_id:
+                    print(f"Fetched coin chain diverged at {current_pair_coin_id.hex()}; refetching")
+                    diverged = True
+                    break
+
+            if len(new_transactions) > 0:
+                sync.checkpoint_pair(pair, new_state, current_pair_coin_id)
+                yield pair, new_transactions, new_heights
+        except BaseException:
+            next_batch_task.cancel()
+            raise
+
+        if diverged:
+            next_batch_task.cancel()
+            coin_record = await sync.client.get_coin_record_by_name(current_pair_coin_id)
+            batch = await fetch_pair_spends(current_pair_coin_id, coin_record, RESYNC_FETCH_BATCH, max_height)
+        else:
+            batch = await next_batch_task
+
+
+async def resync(workers: int):
+    sync.ensure_client()
+    db = database.SessionLocal()
+    max_height = await sync.get_confirmed_height()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # the router walk is short (one spend per deployed pair), so it stays sequential
+        for rcat in [False, True]:
+            current_router = db.query(models.Router).filter(models.Router.rcat == rcat).first()
+            new_router, new_pairs = await sync.sync_router(current_router, max_height)
+            if new_router is not None:
+                db.commit()
+                db.refresh(new_router)
+
+            for new_pair in new_pairs:
+                db.add(new_pair)
+                db.commit()
+
+        all_current_pairs = db.query(models.Pair).order_by(models.Pair.xch_reserve.desc()).all()
+        for current_pair in all_current_pairs:
+            async for new_pair, new_transactions, new_heights in sync_pair_parallel(current_pair, executor, max_height):
+                sync.commit_pair_chunk(db, new_pair, new_transactions, new_heights)
+
+    db.close()
+    await sync.client.session.close()
+
+
+def main():
+    if os.environ.get("COINSET_URL") is None:
+        load_dotenv()
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    print(f"Starting historical resync with {workers} decoding workers...")
+
+    database.init_db()
+    asyncio.run(resync(workers))
+    print("Resync complete")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,27 @@
 # special thanks to the Goby team for this!
 import aiohttp
 from chia.full_node.full_node_rpc_client import FullNodeRpcClient
+from collections import OrderedDict
+from typing import Optional
+import asyncio
+import copy
 import time
 import json
 import random
+import os
+import metrics
+
+# max. number of immutable responses (spent coin records, puzzle solutions,
+# block records) kept in memory
+RPC_CACHE_SIZE = int(os.environ.get("RPC_CACHE_SIZE", "10000"))
+# blocks a response must be buried under before it is considered final (and
+# cached); deeper than any reorg handled by reorg.py
+RPC_CACHE_FINALITY_DEPTH = int(os.environ.get("RPC_CACHE_FINALITY_DEPTH", "100"))
+# Responses closer to the tip, but at or below the confirmed height the sync
+# cycle works up to, are cached until the next cycle starts (start_cycle):
+# pairs spent in the same block ask for the same block record and puzzle
+# solutions. A reorg below that height is rolled back by reorg.py before the
+# next cycle, so no cycle outlives it with stale entries.
 
 class HttpFullNodeRpcClient(FullNodeRpcClient):
     def __init__(self, rpc_url):
@@ -17,14 +35,170 @@ class HttpFullNodeRpcClient(FullNodeRpcClient):
         )
         self.closing_task = None
 
+        # RPC_RECORD_DIR: append every request/response pair to <dir>/<method>.jsonl
+        # RPC_REPLAY_DIR: answer requests from such recordings, without any network
+        self.record_dir = os.environ.get("RPC_RECORD_DIR")
+        self.replay_dir = os.environ.get("RPC_REPLAY_DIR")
+        self.replay_responses = {}
+        self.request_counts = {}
+
+        if self.record_dir is not None:
+            os.makedirs(self.record_dir, exist_ok=True)
+
+        # request key -> response of finalized (immutable) data, LRU ordered
+        self.cache = OrderedDict()
+        # request key -> response at or below confirmed_height, for the
+        # current sync cycle only; LRU ordered as well
+        self.cycle_cache = OrderedDict()
+        self.confirmed_height: Optional[int] = None
+        # request key -> future of the identical request already in flight
+        self.in_flight = {}
+        # from the latest get_blockchain_state response
+        self.peak_height: Optional[int] = None
+
+
+    @staticmethod
+    def request_key(path, request_json) -> str:
+        return path + ":" + json.dumps(request_json, sort_keys=True)
+
+
+    def load_replay_responses(self, path):
+        responses = {}
+        recording = os.path.join(self.replay_dir, f"{path}.jsonl")
+        if os.path.exists(recording):
+            with open(recording) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    responses[self.request_key(path, entry["request"])] = entry["response"]
+        self.replay_responses[path] = responses
+
+
+    def replay(self, path, request_json):
+        if path not in self.replay_responses:
+            self.load_replay_responses(path)
+
+        response = self.replay_responses[path].get(self.request_key(path, request_json))
+        if response is None:
+            raise ValueError(f"No recorded response for {path} {request_json}")
+        return response
+
+
+    def record(self, path, request_json, response_json):
+        with open(os.path.join(self.record_dir, f"{path}.jsonl"), "a") as f:
+            f.write(json.dumps({"request": request_json, "response": response_json}) + "\n")
+
+
+    def start_cycle(self, confirmed_height: int):
+        # called by the sync task once per cycle, after reorg handling
+        self.cycle_cache = OrderedDict()
+        self.confirmed_height = confirmed_height
+
+
+    def is_final(self, height) -> bool:
+        return self.peak_height is not None and height is not None and height <= self.peak_height - RPC_CACHE_FINALITY_DEPTH
+
+
+    def is_confirmed(self, height) -> bool:
+        return self.confirmed_height is not None and height is not None and height <= self.confirmed_height
+
+
+    @staticmethod
+    def response_height(path, request_json, response_json) -> Optional[int]:
+        # height of the block a response describes; None if it may still change
+        if path == "get_block_record_by_height":
+            return request_json.get("height")
+        if path == "get_puzzle_and_solution":
+            return request_json.get("height")
+        if path == "get_coin_record_by_name":
+            coin_record = response_json.get("coin_record")
+            # unspent coins (e.g. the current pair and router coins) change
+            if coin_record is not None and coin_record["spent_block_index"] > 0:
+                return coin_record["spent_block_index"]
+        return None
+
+
+    def is_cacheable(self, path, request_json, response_json) -> bool:
+        if path == "get_block_record":
+            # by header hash
+            return response_json.get("block_record") is not None
+        return self.is_final(self.response_height(path, request_json, response_json))
+
+
+    @staticmethod
+    def store(cache: OrderedDict, key: str, response_json):
+        cache[key] = copy.deepcopy(response_json)
+        if len(cache) > RPC_CACHE_SIZE:
+            cache.popitem(last=False)
+
 
     async def fetch(self, path, request_json):
+        key = self.request_key(path, request_json)
+        for cache, kind in [(self.cache, "cache"), (self.cycle_cache, "cycle_cache")]:
+            cached = cache.get(key)
+            if cached is not None:
+                cache.move_to_end(key)
+                metrics.RPC_DEDUPLICATED.inc(method=path, kind=kind)
+                # callers may modify responses (e.g. coin_record_dict_backwards_compat)
+                return copy.deepcopy(cached)
+
+        # identical concurrent requests share one upstream call
+        in_flight = self.in_flight.get(key)
+        if in_flight is not None:
+            metrics.RPC_DEDUPLICATED.inc(method=path, kind="coalesced")
+            return copy.deepcopy(await asyncio.shield(in_flight))
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            response_json = await self.fetch_uncached(path, request_json)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # retrieved by waiters (if any); avoids "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+
+        future.set_result(copy.deepcopy(response_json))
+        if path == "get_blockchain_state":
+            peak = response_json["blockchain_state"]["peak"]
+            self.peak_height = peak["height"] if peak is not None else None
+        elif self.is_cacheable(path, request_json, response_json):
+            self.store(self.cache, key, response_json)
+        elif self.is_confirmed(self.response_height(path, request_json, response_json)):
+            self.store(self.cycle_cache, key, response_json)
+        return response_json
+
+
+    async def fetch_uncached(self, path, request_json):
+        self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+        start = time.perf_counter()
+        try:
+            if self.replay_dir is not None:
+                return self.replay(path, request_json)
+
+            res_json = await self.fetch_upstream(path, request_json)
+            if self.record_dir is not None:
+                self.record(path, request_json, res_json)
+            return res_json
+        except Exception:
+            metrics.RPC_ERRORS.inc(method=path)
+            raise
+        finally:
+            metrics.RPC_REQUEST_SECONDS.observe(time.perf_counter() - start, method=path)
+
+
+    async def fetch_upstream(self, path, request_json):
         rpc_url = self.rpc_url
         if "," in rpc_url:
             rpc_url = rpc_url.split(",")[0]
             if 'push_tx' in path or 'get_fee_estimate' in path:
                 rpc_url = random.choice(self.rpc_url.split(",")[1:])
-        
+
         async with self.session.post(rpc_url + path, json=request_json) as response:
             if 'push_tx' in path or 'get_fee_estimate' in path:
                 print(f"Using {rpc_url} for {path}:", rpc_url)
@@ -36,4 +210,3 @@ class HttpFullNodeRpcClient(FullNodeRpcClient):
             if not res_json["success"]:
                 raise ValueError(res_json)
             return res_json
-
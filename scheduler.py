@@ -0,0 +1,94 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from typing import Callable, Dict, List, Optional
+import asyncio
+import time
+import os
+
+import models
+
+# Decides when the sync task runs its next cycle and which pairs it polls.
+# A cycle starts as soon as the confirmed height moves past the height the
+# previous cycle covered (back-to-back while catching up); otherwise the chain
+# peak is polled with exponential backoff. Pairs that traded recently are
+# checked every cycle, dormant ones only every DORMANT_PAIR_INTERVAL seconds.
+# Pairs without any transaction yet count as active.
+
+# peak polling backoff while idle, in seconds
+SYNC_POLL_MIN_SECONDS = float(os.environ.get("SYNC_POLL_MIN_SECONDS", "2"))
+SYNC_POLL_MAX_SECONDS = float(os.environ.get("SYNC_POLL_MAX_SECONDS", "30"))
+
+# pairs without a transaction for this long are considered dormant ...
+PAIR_DORMANT_AFTER = int(os.environ.get("PAIR_DORMANT_AFTER", str(7 * 24 * 3600)))
+# ... and are only polled this often
+DORMANT_PAIR_INTERVAL = int(os.environ.get("DORMANT_PAIR_INTERVAL", "600"))
+
+
+class SyncScheduler:
+    def __init__(self):
+        self.poll_interval = SYNC_POLL_MIN_SECONDS
+        # pair launcher id -> timestamp of its latest known transaction / last poll
+        self.last_activity: Dict[str, int] = {}
+        self.last_checked: Dict[str, float] = {}
+
+    def load_activity(self, db: Session):
+        # one grouped query at startup; kept up to date by record_activity
+        self.last_activity = dict(
+            db.query(models.Transaction.pair_launcher_id, func.max(models.Transaction.timestamp))
+            .group_by(models.Transaction.pair_launcher_id)
+            .all()
+        )
+
+    def is_dormant(self, pair_launcher_id: str, now: float) -> bool:
+        # pairs without a known transaction (new ones, possibly created by
+        # another worker's router sync) are active until they have history
+        last_activity = self.last_activity.get(pair_launcher_id)
+        return last_activity is not None and now - last_activity > PAIR_DORMANT_AFTER
+
+    def pairs_due(self, pairs: List[models.Pair], now: Optional[float] = None) -> List[models.Pair]:
+        # pairs: all pairs this worker syncs. Others (e.g. those of a shard
+        # that moved to another worker) are forgotten, so next_dormant_check
+        # does not wake this worker up for them.
+        now = time.time() if now is None else now
+        listed = set(pair.launcher_id for pair in pairs)
+        self.last_checked = {
+            pair_launcher_id: checked for pair_launcher_id, checked in self.last_checked.items()
+            if pair_launcher_id in listed
+        }
+        return [
+            pair for pair in pairs
+            if not self.is_dormant(pair.launcher_id, now)
+            or now - self.last_checked.get(pair.launcher_id, 0) >= DORMANT_PAIR_INTERVAL
+        ]
+
+    def record_checked(self, pair_launcher_id: str, now: Optional[float] = None):
+        self.last_checked[pair_launcher_id] = time.time() if now is None else now
+
+    def record_activity(self, pair_launcher_id: str, timestamp: int):
+        self.last_activity[pair_launcher_id] = max(timestamp, self.last_activity.get(pair_launcher_id, 0))
+
+    def next_dormant_check(self) -> float:
+        # earliest time a dormant pair becomes due again
+        now = time.time()
+        dormant_checks = [
+            checked for pair_launcher_id, checked in self.last_checked.items()
+            if self.is_dormant(pair_launcher_id, now)
+        ]
+        return min(dormant_checks) + DORMANT_PAIR_INTERVAL if len(dormant_checks) > 0 else float("inf")
+
+    async def wait_for_new_blocks(self, get_confirmed_height, synced_height: int, on_poll: Optional[Callable] = None):
+        # returns once the confirmed height passes synced_height, or when a
+        # dormant pair is due for its periodic check
+        while True:
+            if on_poll is not None:
+                on_poll()
+            if await get_confirmed_height() > synced_height:
+                self.poll_interval = SYNC_POLL_MIN_SECONDS
+                return
+
+            delay = min(self.poll_interval, self.next_dormant_check() - time.time())
+            if delay <= 0:
+                return
+
+            await asyncio.sleep(delay)
+            self.poll_interval = min(self.poll_interval * 2, SYNC_POLL_MAX_SECONDS)
@@ -0,0 +1,147 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import List, Optional, Set
+import hashlib
+import socket
+import time
+import uuid
+import os
+
+import models
+
+# Splits sync work across worker processes (main.py's sync task and any number
+# of `python worker.py`). Pairs map to one of SYNC_SHARDS fixed shards by
+# launcher id; every shard, plus the "router" duty (router walk, reorg
+# handling, USD price sync), is assigned to a live worker by rendezvous
+# hashing, so a worker joining or leaving only moves ~1/N of the shards. A
+# worker only syncs what it holds a lease for in sync_leases; leases expire
+# after SYNC_LEASE_SECONDS without renewal, which is how a crashed worker's
+# shards are taken over.
+#
+# Leases are only renewed between pair chunks. A chunk that takes longer than
+# SYNC_LEASE_SECONDS (a slow node, a huge backlog) loses its shard midway and
+# the new owner may sync the same pair at the same time; whichever of the two
+# commits second fails (StaleDataError on Pair.sync_version, or an
+# IntegrityError on the transactions already inserted, which restarts the
+# sync task) and is rolled back, so nothing is indexed twice.
+
+SYNC_SHARDS = int(os.environ.get("SYNC_SHARDS", "16"))
+SYNC_LEASE_SECONDS = int(os.environ.get("SYNC_LEASE_SECONDS", "60"))
+
+ROUTER_LEASE = "router"
+WORKER_LEASE_PREFIX = "worker:"
+
+
+def shard_of(pair_launcher_id: str) -> int:
+    # launcher ids are hashes, so their leading bits are already uniform
+    return int(pair_launcher_id[:16], 16) % SYNC_SHARDS
+
+
+def shard_lease(shard: int) -> str:
+    return f"shard:{shard}"
+
+
+def rendezvous_owner(lease_name: str, workers: List[str]) -> Optional[str]:
+    # highest random weight: the owner of a lease only changes if that worker
+    # leaves, or if the joining worker has the highest weight for it
+    return max(
+        workers,
+        key=lambda worker: hashlib.sha256(f"{worker}/{lease_name}".encode()).digest(),
+        default=None,
+    )
+
+
+class ShardLeases:
+    def __init__(self, worker_id: Optional[str] = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.owned: Set[str] = set()
+        self.refreshed_at = 0.0
+
+    @property
+    def owns_router(self) -> bool:
+        return ROUTER_LEASE in self.owned
+
+    def owns_pair(self, pair_launcher_id: str) -> bool:
+        return shard_lease(shard_of(pair_launcher_id)) in self.owned
+
+    def acquire(self, db: Session, name: str, now: int) -> bool:
+        # false while another worker holds an unexpired lease (e.g. the
+        # previous owner, until it notices the rebalance and releases it)
+        return (
+            db.query(models.SyncLease)
+            .filter(models.SyncLease.name == name)
+            .filter((models.SyncLease.owner == self.worker_id) | (models.SyncLease.expires_at <= now))
+            .update({"owner": self.worker_id, "expires_at": now + SYNC_LEASE_SECONDS}, synchronize_session=False)
+        ) > 0
+
+    def create_leases(self, db: Session, names: List[str]):
+        existing = set(name for (name,) in db.query(models.SyncLease.name).filter(models.SyncLease.name.in_(names)).all())
+        missing = [name for name in names if name not in existing]
+        if len(missing) == 0:
+            return
+
+        for name in missing:
+            db.add(models.SyncLease(name=name, owner=None, expires_at=0))
+        try:
+            db.commit()
+        except IntegrityError:
+            # created by another worker at the same time
+            db.rollback()
+
+    def release(self, db: Session, name: str):
+        (
+            db.query(models.SyncLease)
+            .filter(models.SyncLease.name == name)
+            .filter(models.SyncLease.owner == self.worker_id)
+            .update({"expires_at": 0}, synchronize_session=False)
+        )
+
+    def refresh(self, db: Session):
+        # heartbeat + rebalance; commits, so only call it with no pending sync changes
+        lease_names = [ROUTER_LEASE] + [shard_lease(shard) for shard in range(SYNC_SHARDS)]
+        self.create_leases(db, lease_names + [WORKER_LEASE_PREFIX + self.worker_id])
+
+        now = int(time.time())
+        self.acquire(db, WORKER_LEASE_PREFIX + self.worker_id, now)
+
+        live_workers = [
+            name[len(WORKER_LEASE_PREFIX):]
+            for (name,) in db.query(models.SyncLease.name)
+            .filter(models.SyncLease.name.startswith(WORKER_LEASE_PREFIX))
+            .filter(models.SyncLease.expires_at > now)
+            .all()
+        ]
+
+        owned = set()
+        for name in lease_names:
+            if rendezvous_owner(name, live_workers) == self.worker_id:
+                if self.acquire(db, name, now):
+                    owned.add(name)
+            elif name in self.owned:
+                self.release(db, name)
+
+        # heartbeats of workers that are long gone
+        (
+            db.query(models.SyncLease)
+            .filter(models.SyncLease.name.startswith(WORKER_LEASE_PREFIX))
+            .filter(models.SyncLease.expires_at <= now - SYNC_LEASE_SECONDS)
+            .delete(synchronize_session=False)
+        )
+        db.commit()
+
+        if owned != self.owned:
+            shards = sorted(int(name.split(":")[1]) for name in owned if name != ROUTER_LEASE)
+            print(f"Sync worker {self.worker_id} ({len(live_workers)} live): router={ROUTER_LEASE in owned}, shards={shards}")
+        self.owned = owned
+        self.refreshed_at = time.monotonic()
+
+    def keep_alive(self, db: Session):
+        # renews the leases well before they expire; cheap to call often
+        if time.monotonic() - self.refreshed_at >= SYNC_LEASE_SECONDS / 3:
+            self.refresh(db)
+
+    def release_all(self, db: Session):
+        for name in list(self.owned) + [WORKER_LEASE_PREFIX + self.worker_id]:
+            self.release(db, name)
+        db.commit()
+        self.owned = set()
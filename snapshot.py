@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Database snapshots, so a fresh deployment doesn't have to replay every router
+and pair spend from the launchers.
+
+A snapshot is a gzip-compressed, vacuumed SQLite copy of database.db (routers,
+pairs, transactions, heights and prices) with an extra `snapshot_info` table
+recording the snapshot format version, the height it was taken at and the
+router launcher ids it belongs to. Since routers and pairs keep their
+current_coin_id, the sync task simply resumes from the snapshot height.
+
+```
+python snapshot.py export snapshot.db.gz
+python snapshot.py import snapshot.db.gz [--force]
+```
+
+Setting BOOTSTRAP_SNAPSHOT (a file path or an http(s) URL) makes the API
+import the snapshot on startup if there is no database yet.
+"""
+
+from dotenv import load_dotenv
+import requests
+import tempfile
+import sqlite3
+import shutil
+import gzip
+import time
+import sys
+import os
+
+SNAPSHOT_VERSION = 1
+
+
+def database_path() -> str:
+    # models before database (models imports it for Base); imported here, not
+    # at the top, so a DATABASE_URL from .env is loaded first
+    import models, database
+    return database.engine.url.database
+
+
+def get_router_launcher_ids():
+    return (
+        os.environ.get("TIBET_V2_ROUTER_LAUNCHER_ID"),
+        os.environ.get("TIBET_V2R_ROUTER_LAUNCHER_ID"),
+    )
+
+
+def export_snapshot(output_file: str) -> int:
+    source_path = database_path()
+    if not os.path.exists(source_path):
+        raise ValueError(f"No database at {source_path}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        copy_path = os.path.join(tmp_dir, "snapshot.db")
+
+        # the backup API gives a consistent copy while the syncer keeps writing
+        source = sqlite3.connect(source_path)
+        copy = sqlite3.connect(copy_path)
+        source.backup(copy)
+        source.close()
+
+        height = copy.execute("SELECT MAX(height) FROM height_to_timestamp").fetchone()[0] or 0
+        router_launcher_id, rcat_router_launcher_id = get_router_launcher_ids()
+        copy.execute("DROP TABLE IF EXISTS snapshot_info")
+        copy.execute(
+            "CREATE TABLE snapshot_info (version INTEGER, height BIGINT, created_at BIGINT, "
+            "router_launcher_id VARCHAR(64), rcat_router_launcher_id VARCHAR(64))"
+        )
+        copy.execute(
+            "INSERT INTO snapshot_info VALUES (?, ?, ?, ?, ?)",
+            (SNAPSHOT_VERSION, height, int(time.time()), router_launcher_id, rcat_router_launcher_id)
+        )
+        copy.commit()
+        copy.execute("VACUUM")
+        copy.close()
+
+        with open(copy_path, "rb") as src, gzip.open(output_file, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    print(f"Exported snapshot at height {height} to {output_file} ({os.path.getsize(output_file) / 1024 / 1024:.1f} MiB)")
+    return height
+
+
+def fetch_snapshot(source: str, tmp_dir: str) -> str:
+    if not source.startswith("http://") and not source.startswith("https://"):
+        return source
+
+    local_path = os.path.join(tmp_dir, "snapshot.db.gz")
+    print(f"Downloading snapshot from {source}...")
+    with requests.get(source, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(local_path, "wb") as f:
+            for chunk in response.iter_content(1024 * 1024):
+                f.write(chunk)
+    return local_path
+
+
+def import_snapshot(source: str, force: bool = False) -> int:
+    target_path = database_path()
+    if os.path.exists(target_path) and os.path.getsize(target_path) > 0 and not force:
+        raise ValueError(f"Database {target_path} already exists; use --force to overwrite it")
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(target_path))) as tmp_dir:
+        snapshot_file = fetch_snapshot(source, tmp_dir)
+        db_path = os.path.join(tmp_dir, "database.db")
+        with gzip.open(snapshot_file, "rb") as src, open(db_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        conn = sqlite3.connect(db_path)
+        version, height, router_launcher_id, rcat_router_launcher_id = conn.execute(
+            "SELECT version, height, router_launcher_id, rcat_router_launcher_id FROM snapshot_info"
+        ).fetchone()
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version} (expected {SNAPSHOT_VERSION})")
+        if (router_launcher_id, rcat_router_launcher_id) != get_router_launcher_ids():
+            raise ValueError("Snapshot was taken for different router launcher ids (wrong network?)")
+
+        conn.execute("DROP TABLE snapshot_info")
+        conn.commit()
+        conn.close()
+
+        # same directory -> atomic rename
+        os.replace(db_path, target_path)
+
+    print(f"Imported snapshot at height {height} into {target_path}")
+    return height
+
+
+def bootstrap_if_needed():
+    source = os.environ.get("BOOTSTRAP_SNAPSHOT")
+    if not source:
+        return
+
+    target_path = database_path()
+    if os.path.exists(target_path) and os.path.getsize(target_path) > 0:
+        return
+
+    print(f"No database found; bootstrapping from snapshot {source}")
+    import_snapshot(source)
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ["export", "import"]:
+        print(__doc__)
+        sys.exit(1)
+
+    if os.environ.get("COINSET_URL") is None:
+        load_dotenv()
+
+    if sys.argv[1] == "export":
+        export_snapshot(sys.argv[2])
+    else:
+        import_snapshot(sys.argv[2], force="--force" in sys.argv[3:])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
 #!/bin/bash
 
-uvicorn main:app --host 0.0.0.0 --port 8000
+python migrate.py && uvicorn main:app --host 0.0.0.0 --port 8000
@@ -0,0 +1,154 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from typing import AsyncIterator, Optional, Set
+import asyncio
+import encoding
+import time
+import os
+
+import models
+
+# Broadcast of committed sync chunks (new transactions and the updated pair)
+# and rollbacks to /stream subscribers as server-sent events. Sync may run in
+# other processes (worker.py, other shards' owners), so sync workers record
+# events in stream_events and every API process relays new rows to its own
+# in-process hub.
+
+# max. events buffered per subscriber; clients that fall further behind are
+# disconnected (and should reconnect + re-fetch) instead of stalling the relay
+STREAM_QUEUE_SIZE = int(os.environ.get("STREAM_QUEUE_SIZE", "256"))
+STREAM_HEARTBEAT_SECONDS = 15
+# how often API processes check stream_events for new rows
+STREAM_POLL_SECONDS = float(os.environ.get("STREAM_POLL_SECONDS", "1"))
+# rows older than this are deleted by the router owner
+STREAM_EVENT_RETENTION_SECONDS = int(os.environ.get("STREAM_EVENT_RETENTION_SECONDS", "600"))
+STREAM_RELAY_BATCH_SIZE = 1000
+
+
+class Subscriber:
+    def __init__(self, pair_launcher_id: Optional[str], queue_size: int):
+        self.pair_launcher_id = pair_launcher_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def wants(self, pair_launcher_id: Optional[str]) -> bool:
+        # events without a pair (e.g. rollbacks) go to everyone
+        return self.pair_launcher_id is None or pair_launcher_id is None or self.pair_launcher_id == pair_launcher_id
+
+
+class BroadcastHub:
+    def __init__(self, queue_size: int = STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers: Set[Subscriber] = set()
+
+    def subscribe(self, pair_launcher_id: Optional[str] = None) -> Subscriber:
+        subscriber = Subscriber(pair_launcher_id, self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: str, data: str, pair_launcher_id: Optional[str] = None):
+        # data is serialized JSON (as stored in stream_events); formatted once,
+        # no matter how many subscribers receive it
+        message = f"event: {event}\ndata: {data}\n\n"
+        for subscriber in list(self.subscribers):
+            if not subscriber.wants(pair_launcher_id):
+                continue
+
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # make room for the end-of-stream marker and drop the subscriber
+                self.unsubscribe(subscriber)
+                subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(None)
+
+    async def events(self, pair_launcher_id: Optional[str] = None) -> AsyncIterator[str]:
+        subscriber = self.subscribe(pair_launcher_id)
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # SSE comment; keeps proxies from closing idle connections
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+
+hub = BroadcastHub()
+
+
+def record_event(db: Session, event: str, data: dict, pair_launcher_id: Optional[str] = None):
+    db.add(models.StreamEvent(
+        created_at=int(time.time()),
+        event=event,
+        pair_launcher_id=pair_launcher_id,
+        data=encoding.dumps(data).decode(),
+    ))
+
+
+def record_pair_chunk(db: Session, pair: dict, transactions: list):
+    # after the chunk's commit; commits
+    record_event(db, "transactions", {"pair_launcher_id": pair["launcher_id"], "transactions": transactions}, pair["launcher_id"])
+    record_event(db, "pair", pair, pair["launcher_id"])
+    db.commit()
+
+
+def record_rollback(db: Session, fork_height: int):
+    record_event(db, "rollback", {"fork_height": fork_height})
+    db.commit()
+
+
+def prune_events(db: Session, now: Optional[int] = None):
+    now = int(time.time()) if now is None else now
+    (
+        db.query(models.StreamEvent)
+        .filter(models.StreamEvent.created_at < now - STREAM_EVENT_RETENTION_SECONDS)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+
+
+def relay_new_events(db: Session, last_id: int) -> int:
+    # publishes rows after last_id to the hub; returns the last id relayed
+    while True:
+        events = (
+            db.query(models.StreamEvent.id, models.StreamEvent.event, models.StreamEvent.pair_launcher_id, models.StreamEvent.data)
+            .filter(models.StreamEvent.id > last_id)
+            .order_by(models.StreamEvent.id)
+            .limit(STREAM_RELAY_BATCH_SIZE)
+            .all()
+        )
+        for event in events:
+            hub.publish(event.event, event.data, event.pair_launcher_id)
+        if len(events) > 0:
+            last_id = events[-1].id
+        if len(events) < STREAM_RELAY_BATCH_SIZE:
+            return last_id
+
+
+async def relay_events(stop_event: asyncio.Event):
+    # runs in every API process, whether or not it syncs itself
+    import database
+
+    last_id = None
+    while not stop_event.is_set():
+        db = database.SessionLocal()
+        try:
+            if last_id is None:
+                # subscribers only get events from after they connected
+                last_id = db.query(func.max(models.StreamEvent.id)).scalar() or 0
+            else:
+                last_id = relay_new_events(db, last_id)
+        except Exception as e:
+            print(f"Error relaying stream events: {e}")
+        finally:
+            db.close()
+        await asyncio.sleep(STREAM_POLL_SECONDS)
@@ -5,7 +5,13 @@ from chia.types.condition_opcodes import ConditionOpcode
 from chia.types.blockchain_format.program import Program
 from rpc_client import HttpFullNodeRpcClient
 from chia_rs import Coin
-from typing import List
+from typing import AsyncIterator, List, Optional, Tuple
+from sqlalchemy.orm import Session
+import usd_price_sync
+import leaderboard
+import analytics
+import pair_spend
+import metrics
 import requests
 import models
 import time
@@ -14,6 +20,12 @@ import os
 
 client: HttpFullNodeRpcClient = None
 
+# max. number of pair spends held in memory (and committed together) at once
+PAIR_SYNC_CHUNK_SIZE = int(os.environ.get("PAIR_SYNC_CHUNK_SIZE", "100"))
+
+# number of blocks a spend must be buried under before it is indexed
+CONFIRMATION_DEPTH = int(os.environ.get("CONFIRMATION_DEPTH", "3"))
+
 def ensure_client():
     global client
     if client is not None:
@@ -72,15 +84,18 @@ def create_new_pair(
     )
 
 
-async def sync_router(router: models.Router) -> [models.Router, List[models.Pair]]:
+async def sync_router(
+    router: models.Router,
+    max_height: Optional[int] = None,
+) -> [models.Router, List[models.Pair]]:
     new_pairs: List[models.Pair] = []
 
     current_router_coin_id = bytes.fromhex(router.current_coin_id)
     router_coin_record = await client.get_coin_record_by_name(current_router_coin_id)
-    if not router_coin_record.spent:
+    if not is_confirmed_spend(router_coin_record, max_height):
         return None, []
 
-    while router_coin_record.spent:
+    while is_confirmed_spend(router_coin_record, max_height):
         tail_hash, hidden_puzzle_hash, inverse_fee = None, None, 993
 
         print(f"Processing router coin spend {current_router_coin_id.hex()}...")
@@ -167,6 +182,7 @@ def create_new_transaction(
     new_state: Program,
     height: int,
     index: int,
+    timestamp: int,
 ) -> [models.Transaction, int]:
     state_change = {
         "xch": state_to_xch_reserve(new_state) - state_to_xch_reserve(old_state),
@@ -191,17 +207,14 @@ def create_new_transaction(
         new_state = state_to_dict(new_state),
         height = height,
         pair_tx_index = index,
+        timestamp = timestamp,
     )
 
     trade_volume = abs(state_change["xch"]) if operation == "SWAP" else 0
     return tx, trade_volume
 
-async def sync_pair(
-    pair: models.Pair,
-) -> [models.Pair, List[models.Transaction], List[models.HeightToTimestamp]]:
-    new_transactions = []
-    new_heights = []
-    
+async def get_first_unsynced_pair_coin(pair: models.Pair):
+    # returns (coin id, coin record) of the pair coin sync should continue from
     current_pair_coin_id = bytes.fromhex(pair.current_coin_id)
     coin_record = await client.get_coin_record_by_name(current_pair_coin_id)
 
@@ -217,84 +230,159 @@ async def sync_pair(
         current_pair_coin_id = last_synced_coin.name()
         coin_record = await client.get_coin_record_by_name(current_pair_coin_id)
 
+    return current_pair_coin_id, coin_record
+
+async def get_height_info(height: int) -> Tuple[int, str]:
+    # returns (timestamp, header hash) of the transaction block at height
+    block_record = await client.get_block_record_by_height(height)
+    timestamp = block_record.timestamp if block_record is not None else None
+    while timestamp is None or timestamp == 0:
+        time.sleep(5)
+        block_record = await client.get_block_record_by_height(height)
+        timestamp = block_record.timestamp if block_record is not None else None
+
+    return int(timestamp if timestamp is not None else 0), block_record.header_hash.hex()
+
+async def get_confirmed_height() -> int:
+    # spends above this height are left for the next cycle
+    blockchain_state = await client.get_blockchain_state()
+    return blockchain_state["peak"].height - CONFIRMATION_DEPTH
+
+def record_pair_spend(
+    pair: models.Pair,
+    coin_id: bytes,
+    old_state: Program,
+    new_state: Program,
+    height: int,
+    timestamp: int,
+    header_hash: str,
+) -> [models.Transaction, models.HeightToTimestamp]:
+    tx, volume = create_new_transaction(
+        coin_id.hex(),
+        pair.launcher_id,
+        old_state, new_state,
+        height,
+        int(pair.last_tx_index) + 1,
+        timestamp,
+    )
+
+    pair.trade_volume = int(pair.trade_volume) + volume
+    pair.last_tx_index = int(pair.last_tx_index) + 1
+    metrics.SYNCED_SPENDS.inc()
+    print(f"Volume of tx: {volume / 10 ** 12} XCH")
+
+    return tx, models.HeightToTimestamp(height=height, timestamp=timestamp, header_hash=header_hash)
+
+def is_confirmed_spend(coin_record, max_height: Optional[int]) -> bool:
+    return coin_record.spent and (max_height is None or coin_record.spent_block_index <= max_height)
+
+def checkpoint_pair(pair: models.Pair, state: Program, current_pair_coin_id: bytes):
+    pair.xch_reserve = state_to_xch_reserve(state)
+    pair.token_reserve = state_to_token_reserve(state)
+    pair.liquidity = state_to_liquidity(state)
+    pair.current_coin_id = current_pair_coin_id.hex()
+
+async def sync_pair(
+    pair: models.Pair,
+    max_height: Optional[int] = None,
+    chunk_size: int = PAIR_SYNC_CHUNK_SIZE,
+) -> AsyncIterator[Tuple[models.Pair, List[models.Transaction], List[models.HeightToTimestamp]]]:
+    # yields (pair, new_transactions, new_heights) every chunk_size spends
+    # each yielded pair is a checkpoint: current_coin_id, last_tx_index and
+    # reserves reflect exactly the transactions yielded so far
+    # spends above max_height (not confirmed yet) are left for later
+    new_transactions = []
+    new_heights = []
+    
+    current_pair_coin_id, coin_record = await get_first_unsynced_pair_coin(pair)
     if not coin_record.spent:
-        return None, [], []
+        return
 
     new_state = None
-    while coin_record.spent:
+    while is_confirmed_spend(coin_record, max_height):
         print(f"Processing pair coin spend {current_pair_coin_id.hex()}...")
-        creation_spend = await client.get_puzzle_and_solution(current_pair_coin_id, coin_record.spent_block_index)
-        conditions_dict = conditions_dict_for_solution(
-            creation_spend.puzzle_reveal,
-            creation_spend.solution,
-            INFINITE_COST
-        )
-
-        # for a particular pair, the puzzle run throug p2_merkle_root
-        # returns the new state as the first element!
-        try:
-            old_state = creation_spend.puzzle_reveal.uncurry()[1].at("rf").uncurry()[
-                1].at("rrf")
-        except:
-            old_state = Program.from_bytes(creation_spend.puzzle_reveal.to_bytes()).uncurry()[1].at("rf").uncurry()[
-                1].at("rrf")
-        p2_merkle_solution = None
-        try:
-            p2_merkle_solution = creation_spend.solution.to_program().at("rrf")
-        except:
-            p2_merkle_solution = Program.from_bytes(creation_spend.solution.to_bytes()).at("rrf")
-        new_state_puzzle = p2_merkle_solution.at("f") # p2_merkle_tree_modified -> parameters (which is a puzzle)
-        params = p2_merkle_solution.at("rrf").at("r")
-
-        dummy_singleton_struct = (b"\x00" * 32, (b"\x00" * 32, b"\x00" * 32))
-        dummy_coin_id = b"\x00" * 32
-
-        new_state_puzzle_sol = Program.to([
-            old_state,
-            params,
-            dummy_singleton_struct,
-            dummy_coin_id
-        ])
-        new_state_puzzle_output = new_state_puzzle.run(new_state_puzzle_sol)
-        new_state = new_state_puzzle_output.at("f")
+        if max_height is not None:
+            metrics.PAIR_BACKLOG_BLOCKS.set(max_height - coin_record.spent_block_index, pair=pair.launcher_id)
+
+        with metrics.SYNC_STAGE_SECONDS.time(stage="puzzle_and_solution"):
+            creation_spend = await client.get_puzzle_and_solution(current_pair_coin_id, coin_record.spent_block_index)
+        with metrics.SYNC_STAGE_SECONDS.time(stage="decode"):
+            old_state, new_state, next_coin_id = pair_spend.decode_pair_spend(
+                creation_spend.coin,
+                creation_spend.puzzle_reveal,
+                creation_spend.solution
+            )
+        if next_coin_id is None:
+            raise ValueError(f"Pair coin {current_pair_coin_id.hex()} was spent without being recreated")
 
         height = coin_record.spent_block_index
-        tx, volume = create_new_transaction(
-            current_pair_coin_id.hex(),
-            pair.launcher_id,
-            old_state, new_state,
-            height,
-            int(pair.last_tx_index) + 1,
-        )
+        with metrics.SYNC_STAGE_SECONDS.time(stage="block_record"):
+            timestamp, header_hash = await get_height_info(height)
+        tx, new_height = record_pair_spend(pair, current_pair_coin_id, old_state, new_state, height, timestamp, header_hash)
         new_transactions.append(tx)
+        new_heights.append(new_height)
 
-        block_record = await client.get_block_record_by_height(height)
-        timestamp = block_record.timestamp if block_record is not None else None
-        while timestamp is None or timestamp == 0:
-            time.sleep(5)
-            block_record = await client.get_block_record_by_height(height)
-            timestamp = block_record.timestamp if block_record is not None else None
+        current_pair_coin_id = next_coin_id
 
-        new_heights.append(models.HeightToTimestamp(
-            height=height,
-            timestamp=int(timestamp if timestamp is not None else 0)
-        ))
+        if len(new_transactions) >= chunk_size:
+            checkpoint_pair(pair, new_state, current_pair_coin_id)
+            yield pair, new_transactions, new_heights
+            new_transactions = []
+            new_heights = []
 
-        pair.trade_volume = int(pair.trade_volume) + volume
-        pair.last_tx_index = int(pair.last_tx_index) + 1
-        print(f"Volume of tx: {volume / 10 ** 12} XCH")
+        with metrics.SYNC_STAGE_SECONDS.time(stage="coin_record"):
+            coin_record = await client.get_coin_record_by_name(current_pair_coin_id)
 
-        for cwa in conditions_dict.get(ConditionOpcode.CREATE_COIN, []):
-            new_puzzle_hash = cwa.vars[0]
-            new_amount = cwa.vars[1]
+    metrics.PAIR_BACKLOG_BLOCKS.set(0, pair=pair.launcher_id)
+    if len(new_transactions) > 0:
+        checkpoint_pair(pair, new_state, current_pair_coin_id)
+        yield pair, new_transactions, new_heights
 
-            if new_amount == b"\x01": # CREATE_COIN with amount=1 -> pair recreation
-                current_pair_coin_id = Coin(current_pair_coin_id, new_puzzle_hash, 1).name()
+def check_if_height_exists(db: Session, height: int) -> bool:
+    return db.query(models.HeightToTimestamp).filter(models.HeightToTimestamp.height == height).first() is not None
 
-        coin_record = await client.get_coin_record_by_name(current_pair_coin_id)
+def commit_pair_chunk(
+    db: Session,
+    pair: models.Pair,
+    new_transactions: List[models.Transaction],
+    new_heights: List[models.HeightToTimestamp],
+):
+    # Add all new heights first (they have primary key constraints)
+    # Track which heights we've added in this batch to avoid duplicates
+    added_heights = set()
+    for new_height in new_heights:
+        if new_height.height not in added_heights and not check_if_height_exists(db, new_height.height):
+            db.add(new_height)
+            added_heights.add(new_height.height)
+    
+    # Add all transactions
+    for new_tx in new_transactions:
+        db.add(new_tx)
+
+    # Per-pair hourly aggregates (/pair/{id}/analytics) and the windows
+    # ranked by /leaderboard, derived from them
+    analytics.update_hourly_stats(db, pair, new_transactions)
+    leaderboard.update_pair(db, pair)
+    
+    # Writing the chunk takes the SQLite write lock, so the prices looked up
+    # below are those committed before it, and a concurrent price sync
+    # (store_price_window) cannot commit new ones until this chunk has: it
+    # then counts these transactions itself
+    db.flush()
+
+    # Update USD volumes for all transactions
+    for new_tx in new_transactions:
+        # Update USD volume if price is available
+        while True:
+            try:
+                usd_price_sync.update_transaction_usd_volume(db, new_tx)
+                break
+            except Exception as e:
+                print(f"Error updating USD volume for transaction: {e}")
 
-    pair.xch_reserve = state_to_xch_reserve(new_state)
-    pair.token_reserve = state_to_token_reserve(new_state)
-    pair.liquidity = state_to_liquidity(new_state)
-    pair.current_coin_id = current_pair_coin_id.hex()
-    return pair, new_transactions, new_heights
+            time.sleep(30)
+    
+    # Commit everything together: pair checkpoint, transactions, heights, and USD volumes
+    with metrics.DB_COMMIT_SECONDS.time(kind="pair_chunk"):
+        db.commit()
+    db.refresh(pair)
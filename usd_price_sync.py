@@ -1,11 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
 import requests
+import json
 import time
+import csv
+import os
+import sys
 import models
-from sqlalchemy.orm import Session
-from typing import Optional
 
 CRYPTOCOMPARE_API_URL = "https://min-api.cryptocompare.com/data/v2/histohour"
 
+# hours per request (the API returns at most 2000)
+PRICE_WINDOW_HOURS = 1998
+PRICE_SYNC_WORKERS = int(os.environ.get("PRICE_SYNC_WORKERS", "4"))
+# min. seconds between two price API requests (across all workers)
+PRICE_SYNC_REQUEST_INTERVAL = float(os.environ.get("PRICE_SYNC_REQUEST_INTERVAL", "0.5"))
+PRICE_SYNC_RETRIES = 3
+
 def fetch_price_data(to_timestamp: int, limit: int = 1) -> Optional[dict]:
     try:
         params = {
@@ -57,35 +70,34 @@ def get_price_for_timestamp(db: Session, timestamp: int) -> Optional[models.Aver
     ).first()
 
 
-def update_pair_usd_volumes_for_period(
-    db: Session, 
-    from_timestamp: int, 
-    to_timestamp: int, 
-    price_cents: int
-):
+def update_pair_usd_volumes_for_prices(db: Session, prices: Dict[int, int]):
     """
-    Update USD volumes for all pairs that have SWAP transactions in the given period.
-    This is called when a new price entry is inserted.
+    Update USD volumes for all pairs that have SWAP transactions in the hours
+    of newly inserted price entries (from_timestamp -> price_cents).
     """
-    transactions = db.query(models.Transaction).join(
-        models.HeightToTimestamp,
-        models.Transaction.height == models.HeightToTimestamp.height
+    if len(prices) == 0:
+        return
+
+    transactions = db.query(
+        models.Transaction.pair_launcher_id,
+        models.Transaction.timestamp,
+        models.Transaction.state_change
     ).filter(
         models.Transaction.operation == "SWAP",
-        models.HeightToTimestamp.timestamp >= from_timestamp,
-        models.HeightToTimestamp.timestamp < to_timestamp
+        models.Transaction.timestamp >= min(prices),
+        models.Transaction.timestamp < max(prices) + 3600
     ).all()
     
     pair_volumes = {}
     for tx in transactions:
-        pair_id = tx.pair_launcher_id
+        price_cents = prices.get(tx.timestamp // 3600 * 3600)
+        if price_cents is None:
+            # hour priced earlier; already counted back then
+            continue
+
         xch_volume = abs(tx.state_change.get("xch", 0))
-        
         usd_volume_cents = (xch_volume * price_cents) // (10 ** 12)
-        
-        if pair_id not in pair_volumes:
-            pair_volumes[pair_id] = 0
-        pair_volumes[pair_id] += usd_volume_cents
+        pair_volumes[tx.pair_launcher_id] = pair_volumes.get(tx.pair_launcher_id, 0) + usd_volume_cents
     
     total_updated_usd_volume = 0
     for pair_id, usd_volume in pair_volumes.items():
@@ -96,10 +108,123 @@ def update_pair_usd_volumes_for_period(
             pair.trade_volume_usd = str(int(pair.trade_volume_usd or 0) + usd_volume)
             total_updated_usd_volume += usd_volume
     
-    print(f"Updated USD volumes for {len(pair_volumes)} pairs in period {from_timestamp}-{to_timestamp}")
+    print(f"Updated USD volumes for {len(pair_volumes)} pairs in {len(prices)} hours from {min(prices)}")
     print(f"USD volume delta: +${total_updated_usd_volume/100:.2f}")
 
-def sync_prices(db: Session) -> int:
+
+class RateLimiter:
+    # spaces requests at least `interval` seconds apart, across threads
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_request_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_request_time)
+            self.next_request_time = request_time + self.interval
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+PRICE_FILE_COLUMNS = ["time", "close", "volumefrom", "volumeto"]
+
+
+class PriceFile:
+    """
+    Offline price source with the same interface as fetch_price_data. Reads
+    hourly CryptoCompare-style entries (time, close, volumefrom, volumeto) from
+    a CSV file with a header row or a JSON lines file.
+    """
+    def __init__(self, path: str):
+        self.entries = {}
+        with open(path) as f:
+            if path.endswith(".csv"):
+                rows = csv.DictReader(f)
+            else:
+                rows = (json.loads(line) for line in f if line.strip() != "")
+
+            for row in rows:
+                # only the columns calculate_average_price_cents reads; others
+                # (e.g. conversionType) may be text
+                entry = {
+                    key: float(row[key])
+                    for key in PRICE_FILE_COLUMNS
+                    if row.get(key) not in [None, ""]
+                }
+                entry["time"] = int(entry["time"])
+                self.entries[entry["time"]] = entry
+
+    def __call__(self, to_timestamp: int, limit: int = 1) -> Optional[dict]:
+        first_timestamp = to_timestamp - limit * 3600
+        return {"Data": [
+            self.entries[timestamp]
+            for timestamp in range(first_timestamp, to_timestamp + 1, 3600)
+            if timestamp in self.entries
+        ]}
+
+
+def plan_price_windows(start_timestamp: int, end_timestamp: int) -> List[Tuple[int, int]]:
+    # [from, to) ranges of at most PRICE_WINDOW_HOURS hours
+    windows = []
+    from_ts = start_timestamp
+    while from_ts < end_timestamp:
+        to_ts = min(from_ts + PRICE_WINDOW_HOURS * 3600, end_timestamp)
+        windows.append((from_ts, to_ts))
+        from_ts = to_ts
+    return windows
+
+
+def fetch_price_window(source: Callable, from_ts: int, to_ts: int, rate_limiter: RateLimiter) -> Optional[list]:
+    hours = (to_ts - from_ts) // 3600
+    for attempt in range(PRICE_SYNC_RETRIES):
+        if attempt > 0:
+            time.sleep(2 ** attempt)
+        rate_limiter.wait()
+        # the response covers toTs and the `limit` hours before it (one more
+        # than needed; store_price_window ignores entries outside the window)
+        data = source(to_ts - 3600, hours)
+        if data is not None:
+            return data.get("Data", [])
+    return None
+
+
+def store_price_window(db: Session, entries: list, from_ts: int, to_ts: int) -> int:
+    # idempotent: hours that already have a price are skipped
+    existing = set(
+        from_timestamp for (from_timestamp,) in db.query(models.AverageUsdPrice.from_timestamp).filter(
+            models.AverageUsdPrice.from_timestamp >= from_ts,
+            models.AverageUsdPrice.from_timestamp < to_ts
+        ).all()
+    )
+
+    new_prices = {}
+    for entry in entries:
+        entry_time = entry.get("time")
+        if entry_time < from_ts or entry_time >= to_ts or entry_time in existing or entry_time in new_prices:
+            continue
+
+        new_prices[entry_time] = calculate_average_price_cents(entry)
+
+    for from_timestamp, price_cents in new_prices.items():
+        db.add(models.AverageUsdPrice(
+            from_timestamp=from_timestamp,
+            to_timestamp=from_timestamp + 3600,
+            price_cents=price_cents
+        ))
+    # written (taking the write lock) before the transactions are read: pair
+    # chunks committed earlier are counted here, later ones find the price
+    # themselves (see sync.commit_pair_chunk)
+    db.flush()
+    update_pair_usd_volumes_for_prices(db, new_prices)
+
+    # price entries + USD volume updates are committed together
+    db.commit()
+    return len(new_prices)
+
+
+def sync_prices(db: Session, source: Callable = fetch_price_data, workers: int = PRICE_SYNC_WORKERS) -> int:
     max_synced = get_max_synced_timestamp(db)
     current_time = int(time.time())
     
@@ -116,6 +241,7 @@ def sync_prices(db: Session) -> int:
     else:
         start_timestamp = max_synced
     
+    # last hour that has (almost certainly) been finalized upstream
     max_sync_timestamp = ((current_time - 900) // 3600) * 3600
     
     if start_timestamp >= max_sync_timestamp:
@@ -123,96 +249,69 @@ def sync_prices(db: Session) -> int:
         return max_synced
     
     print(f"Syncing prices from {start_timestamp} to {max_sync_timestamp}")
-    
-    batch_size = 1998 # max is 2000
-    current_timestamp = start_timestamp
+
+    # Windows are fetched concurrently (rate limited) but stored strictly in
+    # order, each in its own commit. The latest stored hour is therefore
+    # always the end of a gap-free prefix, and an interrupted backfill
+    # resumes from there.
+    windows = plan_price_windows(start_timestamp, max_sync_timestamp)
+    rate_limiter = RateLimiter(PRICE_SYNC_REQUEST_INTERVAL)
     synced_count = 0
-    
-    while current_timestamp < max_sync_timestamp:
-        remaining = (max_sync_timestamp - current_timestamp) // 3600
-        limit = min(batch_size, remaining)
-        
-        to_ts = current_timestamp + (limit * 3600)
+    current_timestamp = start_timestamp
 
-        if to_ts >= max_sync_timestamp:
-            to_ts = max_sync_timestamp
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            executor.submit(fetch_price_window, source, from_ts, to_ts, rate_limiter)
+            for from_ts, to_ts in windows
+        ]
 
-        print(f"Fetching {limit} price entries up to timestamp {to_ts}")
-        
-        data = fetch_price_data(to_ts, limit)
-        if data is None:
-            print("Failed to fetch price data")
-            return 0
-        
-        price_entries = data.get("Data", [])
-        if not price_entries:
-            print("No price entries returned")
-            break
-        
-        for entry in price_entries:
-            entry_time = entry.get("time")
-            if entry_time < current_timestamp:
-                continue
-            
-            from_ts = entry_time
-            to_ts = entry_time + 3600
-            if to_ts >= max_sync_timestamp:
-                current_timestamp = max_sync_timestamp
-                break
+        for (from_ts, to_ts), future in zip(windows, futures):
+            entries = future.result()
+            if entries is None:
+                print(f"Failed to fetch price data for {from_ts}-{to_ts}; stored up to {current_timestamp}")
+                return 0
 
-            price_cents = calculate_average_price_cents(entry)
-            
-            existing = db.query(models.AverageUsdPrice).filter(
-                models.AverageUsdPrice.from_timestamp == from_ts
-            ).first()
-            
-            if existing:
-                print(f"Price entry for {from_ts} already exists, skipping")
-                current_timestamp = to_ts
-                continue
-            
-            new_price = models.AverageUsdPrice(
-                from_timestamp=from_ts,
-                to_timestamp=to_ts,
-                price_cents=price_cents
-            )
-            db.add(new_price)
-            
-            update_pair_usd_volumes_for_period(db, from_ts, to_ts, price_cents)
-            
-            # Commit the transaction (price entry + USD volume updates together)
             try:
-                db.commit()
+                synced_count += store_price_window(db, entries, from_ts, to_ts)
             except Exception as e:
-                print(f"Error committing price entry for {from_ts}: {e}")
+                print(f"Error committing price entries for {from_ts}-{to_ts}: {e}")
                 db.rollback()
-                # Skip this entry and continue - it will be retried next time
-                current_timestamp = to_ts
-                continue
-            
-            synced_count += 1
+                return 0
+
             current_timestamp = to_ts
-            print(f"Synced price for {from_ts}: ${price_cents/100:.2f} USD/XCH")
+            print(f"Synced prices up to {to_ts} ({synced_count} new entries)")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
     
     print(f"Successfully synced {synced_count} price entries")
     return current_timestamp
 
+def get_transaction_usd_volume_cents(db: Session, transaction: models.Transaction) -> int:
+    # USD volume (in cents) a SWAP contributes to trade_volume_usd, given the
+    # price data currently in the database
+    if transaction.operation != "SWAP" or not transaction.timestamp:
+        return 0
+
+    price_entry = get_price_for_timestamp(db, transaction.timestamp)
+    if not price_entry:
+        return 0
+
+    xch_volume = abs(transaction.state_change.get("xch", 0))
+    return (xch_volume * price_entry.price_cents) // (10 ** 12)
+
 def update_transaction_usd_volume(db: Session, transaction: models.Transaction):
     if transaction.operation != "SWAP":
         return
     
-    height_entry = db.query(models.HeightToTimestamp).filter(
-        models.HeightToTimestamp.height == transaction.height
-    ).first()
-    
-    if not height_entry:
+    if not transaction.timestamp:
         # print(f"No timestamp found for height {transaction.height}")
         return
     
-    price_entry = get_price_for_timestamp(db, height_entry.timestamp)
+    price_entry = get_price_for_timestamp(db, transaction.timestamp)
     
     if not price_entry:
-        # print(f"No price data available for timestamp {height_entry.timestamp}")
+        # print(f"No price data available for timestamp {transaction.timestamp}")
         return
     
     xch_volume = abs(transaction.state_change.get("xch", 0))
@@ -226,3 +325,29 @@ def update_transaction_usd_volume(db: Session, transaction: models.Transaction):
         pair.trade_volume_usd = str(int(pair.trade_volume_usd or 0) + usd_volume_cents)
         print(f"Updated USD volume for pair {pair.launcher_id}: +${usd_volume_cents/100:.2f}")
 
+
+def main():
+    """
+    Backfill hourly XCH/USD prices (and the pairs' USD volumes) in one pass:
+    ```
+    python usd_price_sync.py backfill [prices.csv|prices.jsonl]
+    ```
+    With a price file, no network requests are made.
+    """
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        print(main.__doc__)
+        sys.exit(1)
+
+    import database
+    database.init_db()
+    db = database.SessionLocal()
+
+    source = PriceFile(sys.argv[2]) if len(sys.argv) > 2 else fetch_price_data
+    synced_until = sync_prices(db, source)
+    db.close()
+    if synced_until == 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
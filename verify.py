@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Offline verifier for the aggregates the syncer maintains incrementally:
+per-pair last_tx_index, reserves, liquidity, trade_volume, trade_volume_usd
+and the pair_hourly_stats rows. Everything is recomputed from transactions
+and average_usd_price in a single pass (in pages, so the sync can keep
+committing meanwhile) and compared to the stored values.
+
+```
+python verify.py [pair_launcher_id]            # report drift (exit code 1 if any)
+python verify.py --repair [pair_launcher_id]   # ... and overwrite it
+```
+
+Run --repair while the sync task is stopped; it would otherwise race with it
+(and drift reported while the sync runs may just be a chunk committed
+between two pages).
+"""
+
+from sqlalchemy.orm import Session
+from typing import Dict, Iterator, Optional, Tuple
+from dotenv import load_dotenv
+import time
+import sys
+
+import analytics
+import leaderboard
+import models
+
+VERIFY_BATCH_SIZE = 10000
+
+PAIR_FIELDS = ["last_tx_index", "xch_reserve", "token_reserve", "liquidity", "trade_volume", "trade_volume_usd"]
+HOURLY_FIELDS = [
+    "transaction_count", "swap_count", "trade_volume", "fee_revenue", "xch_reserve", "token_reserve", "liquidity",
+    "liquidity_added", "liquidity_removed", "liquidity_xch_flow", "liquidity_token_flow",
+]
+
+
+def new_totals() -> dict:
+    return {
+        "last_tx_index": -1,
+        "xch_reserve": 0,
+        "token_reserve": 0,
+        "liquidity": 0,
+        "trade_volume": 0,
+        "trade_volume_usd": 0,
+        # not stored; integrity checks on the transaction chain itself
+        "index_gaps": 0,
+        "broken_states": 0,
+        "hourly": {},
+    }
+
+
+def recompute_pair_totals(db: Session, pair_launcher_id: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+    # yields (pair_launcher_id, totals) for every pair with transactions
+    import database
+
+    prices = dict(db.query(models.AverageUsdPrice.from_timestamp, models.AverageUsdPrice.price_cents).all())
+    inverse_fees = dict(db.query(models.Pair.launcher_id, models.Pair.inverse_fee).all())
+
+    query = db.query(
+        models.Transaction.pair_launcher_id,
+        models.Transaction.pair_tx_index,
+        models.Transaction.operation,
+        models.Transaction.timestamp,
+        models.Transaction.state_change,
+        models.Transaction.new_state,
+    )
+    if pair_launcher_id is not None:
+        query = query.filter(models.Transaction.pair_launcher_id == pair_launcher_id)
+    # served by idx_transactions_pair_tx_index, so no sort is needed
+    order_by = [models.Transaction.pair_launcher_id, models.Transaction.pair_tx_index]
+
+    current_pair = None
+    totals = None
+    # in pages: one read over the whole table would block the sync until done
+    for tx in database.iter_in_pages(query, order_by, VERIFY_BATCH_SIZE):
+        if tx.pair_launcher_id != current_pair:
+            if current_pair is not None:
+                yield current_pair, totals
+            current_pair = tx.pair_launcher_id
+            totals = new_totals()
+
+        if tx.pair_tx_index != totals["last_tx_index"] + 1:
+            totals["index_gaps"] += 1
+        totals["last_tx_index"] = tx.pair_tx_index
+
+        change = tx.state_change
+        state = tx.new_state
+        if (
+            totals["xch_reserve"] + change["xch"] != state["xch"]
+            or totals["token_reserve"] + change["token"] != state["token"]
+            or totals["liquidity"] + change["liquidity"] != state["liquidity"]
+        ):
+            totals["broken_states"] += 1
+        totals["xch_reserve"] = state["xch"]
+        totals["token_reserve"] = state["token"]
+        totals["liquidity"] = state["liquidity"]
+
+        hour = analytics.hour_of(tx.timestamp or 0)
+        hourly = totals["hourly"].get(hour)
+        if hourly is None:
+            hourly = totals["hourly"][hour] = dict.fromkeys(HOURLY_FIELDS, 0)
+        hourly["transaction_count"] += 1
+
+        if tx.operation == "SWAP":
+            xch_volume = abs(change["xch"])
+            totals["trade_volume"] += xch_volume
+            # same rounding as usd_price_sync: per transaction, in cents
+            totals["trade_volume_usd"] += xch_volume * prices.get(hour, 0) // 10 ** 12
+
+            hourly["swap_count"] += 1
+            hourly["trade_volume"] += xch_volume
+            hourly["fee_revenue"] += analytics.swap_fee(change, int(inverse_fees.get(tx.pair_launcher_id) or 1000))
+        else:
+            if change["liquidity"] > 0:
+                hourly["liquidity_added"] += change["liquidity"]
+            else:
+                hourly["liquidity_removed"] -= change["liquidity"]
+            hourly["liquidity_xch_flow"] += change["xch"]
+            hourly["liquidity_token_flow"] += change["token"]
+
+        hourly["xch_reserve"] = state["xch"]
+        hourly["token_reserve"] = state["token"]
+        hourly["liquidity"] = state["liquidity"]
+
+    if current_pair is not None:
+        yield current_pair, totals
+
+
+def stored_hourly_stats(db: Session, pair_launcher_id: str) -> Dict[int, dict]:
+    return {
+        stats.hour: {field: getattr(stats, field) for field in HOURLY_FIELDS}
+        for stats in db.query(models.PairHourlyStats).filter(models.PairHourlyStats.pair_launcher_id == pair_launcher_id)
+    }
+
+
+def pair_drift(pair: models.Pair, totals: dict) -> Dict[str, Tuple[int, int]]:
+    # field -> (stored, recomputed) for every field that differs
+    drift = {}
+    for field in PAIR_FIELDS:
+        stored = int(getattr(pair, field) or 0)
+        if stored != totals[field]:
+            drift[field] = (stored, totals[field])
+    return drift
+
+
+def check_pair(db: Session, launcher_id: str, pair: models.Pair, totals: dict) -> Optional[dict]:
+    # prints the drift of one pair; returns what a repair needs, or None
+    drift = pair_drift(pair, totals)
+    stored_hourly = stored_hourly_stats(db, launcher_id)
+    hourly_drift = sorted(
+        hour for hour in set(stored_hourly) | set(totals["hourly"])
+        if stored_hourly.get(hour) != totals["hourly"].get(hour)
+    )
+
+    if totals["index_gaps"] > 0 or totals["broken_states"] > 0:
+        # not repairable from the transactions themselves; needs a resync
+        print(f"{launcher_id}: {totals['index_gaps']} pair_tx_index gaps, {totals['broken_states']} state changes not matching the previous state")
+
+    if len(drift) == 0 and len(hourly_drift) == 0:
+        return None
+
+    for field, (stored, expected) in drift.items():
+        print(f"{launcher_id}: {field} is {stored}, expected {expected} (drift {stored - expected:+d})")
+    if len(hourly_drift) > 0:
+        print(f"{launcher_id}: {len(hourly_drift)} hourly stats rows differ (first: hour {hourly_drift[0]})")
+
+    return {
+        **{field: totals[field] for field in PAIR_FIELDS},
+        "first_hourly_drift": hourly_drift[0] if len(hourly_drift) > 0 else None,
+    }
+
+
+def repair_pair(db: Session, pair: models.Pair, repair: dict):
+    pair.last_tx_index = repair["last_tx_index"]
+    pair.xch_reserve = repair["xch_reserve"]
+    pair.token_reserve = repair["token_reserve"]
+    pair.liquidity = repair["liquidity"]
+    pair.trade_volume = str(repair["trade_volume"])
+    pair.trade_volume_usd = str(repair["trade_volume_usd"])
+    if repair["first_hourly_drift"] is not None:
+        analytics.rebuild_hourly_stats(db, pair, repair["first_hourly_drift"])
+        leaderboard.update_pair(db, pair)
+    db.commit()
+    print(f"{pair.launcher_id}: repaired")
+
+
+def verify(db: Session, pair_launcher_id: Optional[str] = None, repair: bool = False) -> int:
+    # returns the number of pairs with drift
+    start = time.perf_counter()
+    pairs = db.query(models.Pair)
+    if pair_launcher_id is not None:
+        pairs = pairs.filter(models.Pair.launcher_id == pair_launcher_id)
+    pairs = {pair.launcher_id: pair for pair in pairs.all()}
+
+    # pairs are checked as the stream reaches them, so only the drifted ones'
+    # totals are kept; repairs (commits) wait until the stream is consumed
+    repairs = []
+    transaction_count = 0
+    for launcher_id, totals in recompute_pair_totals(db, pair_launcher_id):
+        transaction_count += totals["last_tx_index"] + 1
+        pair = pairs.pop(launcher_id, None)
+        if pair is None:
+            print(f"{launcher_id}: transactions of an unknown pair")
+            continue
+
+        pair_repair = check_pair(db, launcher_id, pair, totals)
+        if pair_repair is not None:
+            repairs.append((pair, pair_repair))
+
+    # pairs without any transactions
+    for launcher_id, pair in pairs.items():
+        pair_repair = check_pair(db, launcher_id, pair, new_totals())
+        if pair_repair is not None:
+            repairs.append((pair, pair_repair))
+
+    if repair:
+        for pair, pair_repair in repairs:
+            repair_pair(db, pair, pair_repair)
+
+    print(
+        f"Verified {transaction_count} transactions in {time.perf_counter() - start:.1f}s; "
+        f"{len(repairs)} pairs with drift"
+    )
+    return len(repairs)
+
+
+def main():
+    load_dotenv()
+    import database
+
+    args = [arg for arg in sys.argv[1:] if arg != "--repair"]
+    if any(arg.startswith("-") for arg in args):
+        print(__doc__)
+        sys.exit(1)
+
+    db = database.SessionLocal()
+    drifted_pairs = verify(db, args[0] if len(args) > 0 else None, repair="--repair" in sys.argv[1:])
+    db.close()
+
+    if drifted_pairs > 0 and "--repair" not in sys.argv[1:]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Additional sync worker process. The API process (main.py) runs one sync
+worker unless SYNC_IN_API=false; every `python worker.py` started against the same database (and
+with the same .env) joins it and takes over its share of the pair shards, see
+shards.py.
+
+```
+python worker.py
+WORKER_METRICS_PORT=8001 python worker.py   # also serve its /metrics
+```
+
+A worker's sync metrics are only available from the worker itself (the API
+process' /metrics covers its own sync share, if any), so give each worker
+its own port and scrape them all. /stream gets the worker's events through
+the database either way, see stream.py.
+"""
+
+import asyncio
+import os
+
+import main
+import metrics
+
+# 0: no metrics endpoint
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "0"))
+
+
+if __name__ == "__main__":
+    if WORKER_METRICS_PORT > 0:
+        metrics.serve(WORKER_METRICS_PORT)
+        print(f"Serving worker metrics on port {WORKER_METRICS_PORT} (/metrics)")
+    else:
+        print("WORKER_METRICS_PORT is not set; this worker's sync metrics are not exported")
+
+    try:
+        asyncio.run(main.router_and_pairs_sync_task_retry())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        main.release_sync_leases()